@@ -0,0 +1,197 @@
+"""
+ネットワークなしで回せる、エンドツーエンドのスループット計測。
+
+検索API・OpenRouter・法人番号サイト・店舗ページをローカルの代替サーバー（bench/standins.py）に置き換え、
+ResearchAI.run（--target direct）または /api/run（--target api）を指定の並列数で叩いて、
+ルートごとの p50 / p95 / p99 レイテンシと runs/sec を出す。
+
+代替サーバーは1ホストなので、店舗ページの取得は PAGE_FETCH_PER_HOST の上限をそのまま受ける。
+本番に近い数字を見たいときは PAGE_FETCH_PER_HOST を大きくして実行する。
+
+例:
+  # 手元の応答だけで計測（LLM は 1.5 秒 ± 0.5 秒）
+  python bench/bench_e2e.py --runs 200 --concurrency 8 --llm-latency 1.5
+  # /api/run 経由で計測（アプリもこのプロセス内で起動する）
+  python bench/bench_e2e.py --target api --runs 100 --concurrency 8
+  # 起動済みのサーバーを叩く（サーバーは --standins-only が表示する環境変数で起動しておく）
+  python bench/bench_e2e.py --standins-only --port 9000
+  python bench/bench_e2e.py --target api --api-url http://localhost:8080
+  # 本物の応答を記録して、あとでオフライン再生する
+  python bench/bench_e2e.py --mode record --record-file rec.json --shops shops.json --key sk-...
+  python bench/bench_e2e.py --mode replay --record-file rec.json --shops shops.json
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from standins import SCENARIOS, StandinConfig, standin_env, start_standins  # noqa: E402
+
+
+def load_shops(path, runs):
+    """
+    [{"shopname": ..., "shopaddress": ...}, ...] の JSON。なければ架空の店を runs 件作る。
+    """
+    if path:
+        with open(path, encoding="utf-8") as f:
+            shops = json.load(f)
+        return [shops[i % len(shops)] for i in range(runs)]
+    return [
+        {"shopname": f"ベンチ食堂 {i}号店", "shopaddress": f"東京都新宿区西新宿{i % 9 + 1}-{i % 20 + 1}-1"}
+        for i in range(runs)
+    ]
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def report(samples, elapsed):
+    """
+    samples: [(route, seconds), ...]
+    """
+    by_route = {}
+    for route, seconds in samples:
+        by_route.setdefault(route, []).append(seconds)
+
+    print(f"\nruns: {len(samples)}  elapsed: {elapsed:.2f}s  throughput: {len(samples) / elapsed:.2f} runs/sec")
+    print(f"{'route':32s} {'count':>6s} {'p50':>8s} {'p95':>8s} {'p99':>8s} {'runs/s':>8s}")
+    rows = sorted(by_route.items()) + [("(all)", [s for _, s in samples])]
+    for route, values in rows:
+        print(
+            f"{route:32s} {len(values):6d} "
+            f"{percentile(values, 50):8.2f} {percentile(values, 95):8.2f} {percentile(values, 99):8.2f} "
+            f"{len(values) / elapsed:8.2f}"
+        )
+
+
+def start_app_server():
+    """
+    main.app をこのプロセス内でスレッド付きサーバーとして起動する。
+    """
+    from werkzeug.serving import make_server
+
+    import main
+
+    server = make_server("127.0.0.1", 0, main.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ResearchAI のオフライン E2E ベンチマーク")
+    parser.add_argument("--target", choices=["direct", "api"], default="direct")
+    parser.add_argument("--api-url", help="起動済みのサーバー（省略時はこのプロセス内で起動）")
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--shops", help="店舗リストの JSON")
+    parser.add_argument("--key", default="bench-key")
+    parser.add_argument("--speculative", action="store_true", help="ResearchAI の先行並列実行を有効にする")
+    parser.add_argument("--keep-caches", action="store_true", help="キャッシュを無効にせず計測する")
+    parser.add_argument("--llm-rpm", type=float, default=0,
+                        help="LLM 呼び出しのキーごとの 1分あたりの上限（既定 0 = 制限なし）")
+
+    parser.add_argument("--mode", choices=["canned", "record", "replay"], default="canned")
+    parser.add_argument("--record-file")
+    parser.add_argument("--scenario", choices=["mixed"] + SCENARIOS, default="mixed")
+    parser.add_argument("--llm-latency", type=float, default=1.0)
+    parser.add_argument("--llm-jitter", type=float, default=0.5)
+    parser.add_argument("--search-latency", type=float, default=0.3)
+    parser.add_argument("--page-latency", type=float, default=0.2)
+    parser.add_argument("--page-kb", type=int, default=30)
+
+    parser.add_argument("--standins-only", action="store_true", help="代替サーバーだけ起動して待つ")
+    parser.add_argument("--port", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    config = StandinConfig(
+        mode=args.mode,
+        scenario=args.scenario,
+        llm_latency=args.llm_latency,
+        llm_jitter=args.llm_jitter,
+        search_latency=args.search_latency,
+        page_latency=args.page_latency,
+        page_kb=args.page_kb,
+        record_file=args.record_file,
+    )
+    server, base_url = start_standins(config, port=args.port)
+    env = standin_env(base_url)
+
+    if args.standins_only:
+        print(f"代替サーバー: {base_url}  （Ctrl+C で終了）")
+        for k, v in env.items():
+            print(f"export {k}={v}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            return 0
+
+    # main を import する前に、向き先とキャッシュの設定を済ませる
+    os.environ.update(env)
+    if args.speculative:
+        os.environ["RUN_SPECULATIVE"] = "1"
+    os.environ["LLM_RPM"] = str(args.llm_rpm)
+    if not args.keep_caches:
+        os.environ["PAGE_CACHE_DIR"] = ""
+        os.environ["SEARCH_CACHE_SIZE"] = "0"
+        os.environ["LLM_CACHE_BACKEND"] = "none"
+        os.environ["RESULT_STORE_BACKEND"] = "none"
+
+    shops = load_shops(args.shops, args.runs)
+
+    if args.target == "direct":
+        import main as app_main
+
+        def one(shop):
+            start = time.perf_counter()
+            try:
+                result = app_main.ResearchAI(shop["shopname"], shop["shopaddress"], args.key).run()
+                route = result.get("route")
+            except Exception as e:
+                print("⚠", e)
+                route = "exception"
+            return route, time.perf_counter() - start
+    else:
+        from http_client import get_session
+
+        api_url = args.api_url or start_app_server()
+
+        def one(shop):
+            start = time.perf_counter()
+            try:
+                res = get_session().post(
+                    f"{api_url}/api/run", json=dict(shop, key=args.key), timeout=600
+                )
+                route = res.json().get("route") if res.status_code == 200 else f"http_{res.status_code}"
+            except Exception as e:
+                print("⚠", e)
+                route = "exception"
+            return route, time.perf_counter() - start
+
+    print(f"target={args.target} mode={args.mode} runs={len(shops)} concurrency={args.concurrency}")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as ex:
+        samples = list(ex.map(one, shops))
+    elapsed = time.perf_counter() - start
+
+    report(samples, elapsed)
+    server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""
+HTML → テキスト変換のマイクロベンチマーク（lxml エンジン vs 従来の bs4 エンジン）。
+
+本番と同じ extract_text_from_str（http_client.stream_html でデコード済みの文字列を受け取る）を計測する。
+保存済みの店舗ページ（*.html）のディレクトリを読み、デコードしてから、エンジンごとに
+  - pages/sec
+  - 抽出テキストの一致率（bs4 の行のうち lxml でも出てきた行の割合）
+を出す。
+
+使い方:
+  # コーパスを作る（URL を渡すと bench/corpus/ に保存する）
+  python bench/bench_extract.py --save https://tabelog.com/... https://example.co.jp/company/
+  # 計測
+  python bench/bench_extract.py --corpus bench/corpus --repeat 5
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from html_text import detect_encoding, extract_text_from_str  # noqa: E402
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+
+
+def save_pages(urls, corpus):
+    """
+    ページを取得して、本文（.html）とレスポンスヘッダー（.headers.json）を保存する。
+    """
+    from http_client import get_session
+    from main import HEADERS
+
+    os.makedirs(corpus, exist_ok=True)
+    for url in urls:
+        name = hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
+        res = get_session().get(url, headers=HEADERS, timeout=10)
+        with open(os.path.join(corpus, name + ".html"), "wb") as f:
+            f.write(res.content)
+        with open(os.path.join(corpus, name + ".headers.json"), "w", encoding="utf-8") as f:
+            json.dump({"url": url, **dict(res.headers)}, f, ensure_ascii=False)
+        print("saved:", url, "->", name)
+
+
+def load_corpus(corpus):
+    pages = []
+    for path in sorted(glob.glob(os.path.join(corpus, "*.html"))):
+        with open(path, "rb") as f:
+            content = f.read()
+        headers = {}
+        headers_path = path[:-len(".html")] + ".headers.json"
+        if os.path.exists(headers_path):
+            with open(headers_path, encoding="utf-8") as f:
+                headers = json.load(f)
+        # 本番ではデコードは受信時に済んでいるので、計測には含めない
+        text = content.decode(detect_encoding(content, headers), errors="replace")
+        pages.append((os.path.basename(path), text))
+    return pages
+
+
+def _lines(text):
+    return {line.strip() for line in text.splitlines() if line.strip()}
+
+
+def bench(pages, repeat):
+    texts = {}
+    results = {}
+
+    for name in ("bs4", "lxml"):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for page_name, html_text in pages:
+                texts[(name, page_name)] = extract_text_from_str(html_text, engine=name)
+        elapsed = time.perf_counter() - start
+        results[name] = {
+            "pages_per_sec": len(pages) * repeat / elapsed if elapsed else 0.0,
+            "seconds": elapsed,
+        }
+
+    parity = []
+    for page_name, _ in pages:
+        base = _lines(texts[("bs4", page_name)])
+        fast = _lines(texts[("lxml", page_name)])
+        if base:
+            parity.append(len(base & fast) / len(base))
+
+    return results, (sum(parity) / len(parity) if parity else None)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTML → テキスト変換のベンチマーク")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--save", nargs="+", metavar="URL", help="ページを取得してコーパスに保存する")
+    args = parser.parse_args(argv)
+
+    if args.save:
+        save_pages(args.save, args.corpus)
+        return 0
+
+    pages = load_corpus(args.corpus)
+    if not pages:
+        print(f"コーパスが空です: {args.corpus}（--save で作成してください）")
+        return 1
+
+    results, parity = bench(pages, args.repeat)
+
+    print(f"pages: {len(pages)}  repeat: {args.repeat}")
+    for name, r in results.items():
+        print(f"  {name:5s} {r['pages_per_sec']:8.1f} pages/sec  ({r['seconds']:.2f}s)")
+    if results["bs4"]["seconds"]:
+        print(f"  speedup: x{results['bs4']['seconds'] / results['lxml']['seconds']:.2f}")
+    if parity is not None:
+        print(f"  text parity (bs4 の行が lxml にも含まれる割合): {parity:.1%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,357 @@
+"""
+ベンチマーク用のローカル代替サーバー（検索API・OpenRouter・法人番号サイト・店舗ページ）。
+
+1つの HTTP サーバーで次のパスを受ける:
+  GET  /search?q=...&top_n=...         検索API（links を返す）
+  POST /api/v1/chat/completions        OpenRouter 互換（決まった JSON を返す）
+  GET  /nta?selHouzinNo=...            法人番号サイト（main.py の XPath で法人名が取れる HTML）
+  GET  /pages/<id>.html                店舗ページ
+  GET  /proxy?url=...                  記録/再生モードでのページ取得
+
+モード:
+  canned : すべて手元で作った応答を返す（ネットワーク不要）
+  record : 本物のサービスに転送し、応答をファイルに保存する
+  replay : record で保存した応答だけを返す（ネットワーク不要）
+"""
+import base64
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlencode, urlparse
+
+# canned モードで LLM が返すルート。mixed は店ごとにハッシュで振り分ける
+SCENARIOS = [
+    "shop_direct",
+    "invoice_corp_representative",
+    "corp_representative",
+    "corp_without_rep",
+    "shopname_only",
+    "no_info",
+]
+
+BENCH_COMPANY = "株式会社ベンチマーク"
+# この法人名で代表者を聞かれたら "Unknown" を返す（corp_without_rep 用）
+BENCH_COMPANY_NO_REP = "株式会社ベンチマーク代表不明"
+BENCH_REPRESENTATIVE = "山田太郎"
+# チェックデジットが正しい番号（法人番号 1180301018771）
+BENCH_INVOICE = "T1180301018771"
+
+REAL_UPSTREAMS = {
+    "search": "https://ecosia1-477268798017.europe-west1.run.app/search",
+    "llm": "https://openrouter.ai/api/v1/chat/completions",
+    "nta": "https://www.houjin-bangou.nta.go.jp/henkorireki-johoto.html",
+}
+
+
+class StandinConfig:
+    def __init__(
+        self,
+        mode="canned",
+        scenario="mixed",
+        llm_latency=1.0,
+        llm_jitter=0.5,
+        search_latency=0.3,
+        page_latency=0.2,
+        nta_latency=0.2,
+        page_kb=30,
+        record_file=None,
+        upstreams=None,
+    ):
+        self.mode = mode
+        self.scenario = scenario
+        self.llm_latency = llm_latency
+        self.llm_jitter = llm_jitter
+        self.search_latency = search_latency
+        self.page_latency = page_latency
+        self.nta_latency = nta_latency
+        self.page_kb = page_kb
+        self.record_file = record_file
+        self.upstreams = dict(REAL_UPSTREAMS, **(upstreams or {}))
+
+
+class RecordStore:
+    """
+    記録した応答を (メソッド, パス, クエリ, ボディのハッシュ) をキーにして JSON ファイルに保存する。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = {}
+        try:
+            with open(path, encoding="utf-8") as f:
+                self._data = json.load(f)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def key(method, path, query, body):
+        digest = hashlib.sha256(body or b"").hexdigest()[:16]
+        return f"{method} {path}?{urlencode(sorted(query.items()))} {digest}"
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        return item["status"], item["content_type"], base64.b64decode(item["body"])
+
+    def put(self, key, status, content_type, body):
+        with self._lock:
+            self._data[key] = {
+                "status": status,
+                "content_type": content_type,
+                "body": base64.b64encode(body).decode("ascii"),
+            }
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(self._data, f, ensure_ascii=False)
+
+
+def _scenario_for(config, text):
+    if config.scenario != "mixed":
+        return config.scenario
+    h = int(hashlib.sha256(text.encode("utf-8")).hexdigest(), 16)
+    return SCENARIOS[h % len(SCENARIOS)]
+
+
+def _shop_from_prompt(system_prompt, user_content):
+    """
+    プロンプトから店名を取り出す（シナリオの振り分けと応答の中身に使う）。
+    """
+    for line in system_prompt.splitlines():
+        line = line.strip()
+        if line.startswith("- 店名:"):
+            return line[len("- 店名:"):].strip()
+    try:
+        return json.loads(user_content)["target_shop"]["name"]
+    except (ValueError, KeyError, TypeError):
+        return ""
+
+
+def canned_llm_content(config, system_prompt, user_content):
+    """
+    ResearchAI の各プロンプトに対して、シナリオどおりの JSON 文字列を返す。
+    """
+    shop = _shop_from_prompt(system_prompt, user_content)
+    scenario = _scenario_for(config, shop or system_prompt)
+
+    if "インボイス番号" in system_prompt:
+        ok = scenario == "invoice_corp_representative"
+        return json.dumps({"result": BENCH_INVOICE if ok else "Unknown"})
+
+    if "has_representative_info" in system_prompt:
+        page = {
+            "url": "",
+            "is_match": scenario == "shop_direct",
+            "reason": "benchmark",
+            "has_representative_info": scenario == "shop_direct",
+            "representative_name": BENCH_REPRESENTATIVE if scenario == "shop_direct" else None,
+            "representative_title": "店主" if scenario == "shop_direct" else None,
+            "company_name": None,
+            "raw_snippet": None,
+            "confidence": 0.9 if scenario == "shop_direct" else 0.1,
+        }
+        return json.dumps({
+            "target_shop": {"name": shop, "address": ""},
+            "pages": [page],
+            "has_any_representative_info": scenario == "shop_direct",
+        }, ensure_ascii=False)
+
+    if "運営法人名" in system_prompt:
+        if scenario == "corp_representative":
+            return json.dumps({"result": BENCH_COMPANY}, ensure_ascii=False)
+        if scenario == "corp_without_rep":
+            return json.dumps({"result": BENCH_COMPANY_NO_REP}, ensure_ascii=False)
+        if scenario == "shopname_only":
+            return json.dumps({"result": shop}, ensure_ascii=False)
+        return json.dumps({"result": "False"})
+
+    # 法人 → 代表者（このプロンプトには店名がないので、法人名で振り分ける）
+    ok = BENCH_COMPANY_NO_REP not in system_prompt
+    return json.dumps({"result": BENCH_REPRESENTATIVE if ok else "Unknown"}, ensure_ascii=False)
+
+
+def shop_page_html(page_id, kb):
+    filler = "".join(f"<li>メニュー {i} ラーメン 900円</li>" for i in range(kb * 1024 // 40))
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>店舗ページ {page_id}</title>
+<script>var tracking = "{page_id}";</script><style>body {{ margin: 0 }}</style></head>
+<body><nav>ホーム | ランキング | ログイン</nav>
+<h1>ベンチ食堂 {page_id}</h1>
+<p>住所：東京都新宿区西新宿1-2-3</p>
+<ul>{filler}</ul>
+<footer>運営会社：{BENCH_COMPANY}</footer>
+</body></html>""".encode("utf-8")
+
+
+def nta_page_html(number):
+    # main.py の XPath: /html/body/div[1]/form/div[3]/main/div/div[1]/dl/dd[2]/text()
+    return f"""<html><body><div><form>
+<div></div><div></div>
+<div><main><div><div><dl><dt>法人番号</dt><dd>{number}</dd><dt>商号又は名称</dt><dd>{BENCH_COMPANY}</dd></dl></div></div></main></div>
+</form></div></body></html>""".encode("utf-8")
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    config = None
+    store = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    # ---------- 共通 ----------
+
+    def _send(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _sleep(self, latency, jitter=0.0):
+        if latency > 0 or jitter > 0:
+            time.sleep(max(0.0, latency + random.uniform(-jitter, jitter)))
+
+    def _base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _upstream(self, method, url, body=None, headers=None):
+        """
+        record: 本物に転送して保存 / replay: 保存済みの応答を返す。
+        """
+        parsed = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        key = RecordStore.key(method, parsed.path, query, body)
+
+        if self.config.mode == "replay":
+            item = self.store.get(key)
+            if item is None:
+                return 404, "text/plain", f"not recorded: {key}".encode("utf-8")
+            return item
+
+        import requests
+
+        res = requests.request(method, url, data=body, headers=headers or {}, timeout=120)
+        content_type = res.headers.get("Content-Type", "application/octet-stream")
+        self.store.put(key, res.status_code, content_type, res.content)
+        return res.status_code, content_type, res.content
+
+    def _rewrite_links(self, body):
+        """
+        本物の検索結果のリンクを /proxy 経由に書き換える（ページも記録・再生できるように）。
+        """
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return body
+        base = self._base_url()
+        data["links"] = [f"{base}/proxy?url={quote(link, safe='')}" for link in data.get("links", [])]
+        return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+    # ---------- GET ----------
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        cfg = self.config
+
+        if parsed.path == "/search":
+            self._sleep(cfg.search_latency)
+            if cfg.mode == "canned":
+                top_n = int(query.get("top_n", 3))
+                h = hashlib.sha256(query.get("q", "").encode("utf-8")).hexdigest()[:12]
+                links = [f"{self._base_url()}/pages/{h}-{i}.html" for i in range(top_n)]
+                body = json.dumps({"links": links}).encode("utf-8")
+                return self._send(200, "application/json", body)
+            status, ctype, body = self._upstream(
+                "GET", f"{cfg.upstreams['search']}?{parsed.query}"
+            )
+            return self._send(status, ctype, self._rewrite_links(body))
+
+        if parsed.path.startswith("/pages/"):
+            self._sleep(cfg.page_latency)
+            page_id = parsed.path[len("/pages/"):].rsplit(".", 1)[0]
+            return self._send(200, "text/html; charset=utf-8", shop_page_html(page_id, cfg.page_kb))
+
+        if parsed.path == "/proxy":
+            status, ctype, body = self._upstream(
+                "GET", query.get("url", ""), headers={"User-Agent": self.headers.get("User-Agent", "")}
+            )
+            return self._send(status, ctype, body)
+
+        if parsed.path == "/nta":
+            self._sleep(cfg.nta_latency)
+            if cfg.mode == "canned":
+                number = query.get("selHouzinNo", "")
+                return self._send(200, "text/html; charset=utf-8", nta_page_html(number))
+            status, ctype, body = self._upstream("GET", f"{cfg.upstreams['nta']}?{parsed.query}")
+            return self._send(status, ctype, body)
+
+        self._send(404, "text/plain", b"not found")
+
+    # ---------- POST ----------
+
+    def do_POST(self):
+        parsed = urlparse(self.path)
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        cfg = self.config
+
+        if parsed.path != "/api/v1/chat/completions":
+            return self._send(404, "text/plain", b"not found")
+
+        if cfg.mode != "canned":
+            headers = {
+                "Authorization": self.headers.get("Authorization", ""),
+                "Content-Type": "application/json",
+            }
+            status, ctype, res_body = self._upstream("POST", cfg.upstreams["llm"], body, headers)
+            return self._send(status, ctype, res_body)
+
+        self._sleep(cfg.llm_latency, cfg.llm_jitter)
+        data = json.loads(body)
+        messages = data.get("messages", [])
+        system_prompt = messages[0]["content"] if messages else ""
+        user_content = messages[1]["content"] if len(messages) > 1 else ""
+
+        content = canned_llm_content(cfg, system_prompt, user_content)
+        res = {
+            "id": "bench",
+            "model": data.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}}],
+        }
+        self._send(200, "application/json", json.dumps(res, ensure_ascii=False).encode("utf-8"))
+
+
+def start_standins(config, host="127.0.0.1", port=0):
+    """
+    代替サーバーをバックグラウンドで起動し、(server, base_url) を返す。
+    """
+    store = None
+    if config.mode in ("record", "replay"):
+        if not config.record_file:
+            raise ValueError("record / replay モードには record_file が必要です")
+        store = RecordStore(config.record_file)
+
+    handler = type("BoundStandinHandler", (StandinHandler,), {"config": config, "store": store})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    base_url = f"http://{host}:{server.server_address[1]}"
+    return server, base_url
+
+
+def standin_env(base_url):
+    """
+    main.py を代替サーバーに向けるための環境変数。
+    """
+    return {
+        "SEARCH_URL": f"{base_url}/search",
+        "OPENROUTER_URL": f"{base_url}/api/v1/chat/completions",
+        "NTA_URL": f"{base_url}/nta",
+    }
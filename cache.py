@@ -0,0 +1,185 @@
+"""
+TTL 付きのキー・バリューキャッシュ。
+
+- MemoryCache : プロセス内の LRU（件数上限あり）
+- SQLiteCache : SQLite ファイルに保存（Cloud Run の再起動をまたいで残る）
+- TieredCache : MemoryCache を前段にして SQLiteCache に書き通す
+
+値は JSON にできるものだけを入れる。get() が None を返したらキャッシュなし。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryCache:
+    def __init__(self, max_entries=1024, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # key -> (expires_at, value)。先頭ほど最近使われていない
+        self._data = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.time():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "memory",
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+            }
+
+
+class SQLiteCache:
+    # set() が何回呼ばれるごとに期限切れ行を掃除するか
+    PURGE_EVERY = 500
+
+    def __init__(self, path, ttl=3600, table="cache"):
+        self.path = path
+        self.ttl = ttl
+        self.table = table
+        self.hits = 0
+        self.misses = 0
+        self._sets = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+    def get_entry(self, key):
+        """
+        (value, expires_at) を返す。なければ None。
+        """
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] < time.time():
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0]), row[1]
+
+    def get(self, key):
+        entry = self.get_entry(key)
+        return entry[0] if entry is not None else None
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        data = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, data, expires_at),
+            )
+            self._sets += 1
+            if self._sets % self.PURGE_EVERY == 0:
+                self._conn.execute(
+                    f"DELETE FROM {self.table} WHERE expires_at < ?", (time.time(),)
+                )
+            self._conn.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            (entries,) = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+            return {
+                "backend": "sqlite",
+                "path": self.path,
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": entries,
+            }
+
+
+class TieredCache:
+    """
+    メモリを先に見て、なければ SQLite を見る（見つかったらメモリにも載せる）。
+    """
+
+    def __init__(self, memory, persistent):
+        self.memory = memory
+        self.persistent = persistent
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+        entry = self.persistent.get_entry(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        self.memory.set(key, value, ttl=expires_at - time.time())
+        return value
+
+    def set(self, key, value, ttl=None):
+        self.memory.set(key, value, ttl)
+        self.persistent.set(key, value, ttl)
+
+    def delete(self, key):
+        self.memory.delete(key)
+        self.persistent.delete(key)
+
+    def stats(self):
+        return {
+            "backend": "tiered",
+            "memory": self.memory.stats(),
+            "sqlite": self.persistent.stats(),
+        }
+
+
+def create_cache(max_entries, ttl, sqlite_path=None, table="cache"):
+    """
+    sqlite_path があれば TieredCache、なければ MemoryCache を返す。
+    """
+    memory = MemoryCache(max_entries=max_entries, ttl=ttl)
+    if not sqlite_path:
+        return memory
+    try:
+        return TieredCache(memory, SQLiteCache(sqlite_path, ttl=ttl, table=table))
+    except sqlite3.Error as e:
+        print("⚠ SQLite キャッシュを開けません（メモリのみで動かします）:", e)
+        return memory
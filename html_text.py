@@ -0,0 +1,119 @@
+"""
+HTML → テキスト変換。
+
+- lxml エンジン（既定）: lxml でパースし、script / style / nav などを落としてテキストを取る
+- bs4 エンジン: 従来どおり BeautifulSoup(html.parser) の get_text
+
+文字コードは Content-Type ヘッダー → BOM → <meta> → UTF-8 として読めるか の順に決め、
+どれでも決まらないときだけ本文全体の文字コード推定（requests の apparent_encoding 相当）を使う。
+"""
+import codecs
+import os
+import re
+
+from lxml import etree
+from lxml import html as lxml_html
+
+HTML_EXTRACT_ENGINE = os.environ.get("HTML_EXTRACT_ENGINE", "lxml")
+
+# テキストにしない要素
+DROP_TAGS = [
+    "script",
+    "style",
+    "noscript",
+    "template",
+    "nav",
+    "svg",
+    "iframe",
+]
+
+_CHARSET_RE = re.compile(rb"""charset\s*=\s*["']?\s*([A-Za-z0-9_\-:.]+)""", re.I)
+
+# Shift_JIS 系は機種依存文字を含む cp932 として読む
+_ENCODING_ALIASES = {
+    "shift_jis": "cp932",
+    "shift-jis": "cp932",
+    "sjis": "cp932",
+    "x-sjis": "cp932",
+    "windows-31j": "cp932",
+    "ms_kanji": "cp932",
+}
+
+
+def _normalize_encoding(name):
+    if not name:
+        return None
+    name = name.strip().lower()
+    name = _ENCODING_ALIASES.get(name, name)
+    try:
+        return codecs.lookup(name).name
+    except LookupError:
+        return None
+
+
+def sniff_encoding(head, headers=None):
+    """
+    Content-Type ヘッダー・BOM・<meta> だけで文字コードを決める（決まらなければ None）。
+    head は本文の先頭部分でよいので、ストリーミング受信中にも使える。
+    """
+    content_type = (headers or {}).get("Content-Type", "")
+    m = _CHARSET_RE.search(content_type.encode("latin-1", "ignore"))
+    if m:
+        enc = _normalize_encoding(m.group(1).decode("ascii", "ignore"))
+        if enc:
+            return enc
+
+    if head.startswith(codecs.BOM_UTF8):
+        return "utf-8"
+
+    # <meta charset> / <meta http-equiv content="...; charset=..."> は先頭付近にあるはず
+    m = _CHARSET_RE.search(head[:4096])
+    if m:
+        enc = _normalize_encoding(m.group(1).decode("ascii", "ignore"))
+        if enc:
+            return enc
+
+    return None
+
+
+def detect_encoding(content, headers=None):
+    """
+    content: レスポンス本文（bytes）
+    headers: レスポンスヘッダー（Content-Type を見る）
+    """
+    enc = sniff_encoding(content, headers)
+    if enc:
+        return enc
+
+    try:
+        content.decode("utf-8")
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+
+    # 最後の手段：本文全体から推定（重い）
+    import charset_normalizer
+    best = charset_normalizer.from_bytes(content).best()
+    return best.encoding if best else "utf-8"
+
+
+def extract_text_from_str(html_text, engine=None):
+    """
+    デコード済みの HTML 文字列からテキストを取り出す（ストリーミング受信用）。
+    """
+    engine = engine or HTML_EXTRACT_ENGINE
+
+    if engine == "lxml":
+        try:
+            parser = lxml_html.HTMLParser(remove_comments=True)
+            doc = lxml_html.document_fromstring(html_text, parser=parser)
+            etree.strip_elements(doc, *DROP_TAGS, with_tail=False)
+            return "\n".join(doc.itertext())
+        except (etree.LxmlError, ValueError) as e:
+            # <?xml encoding=...?> 付きの文字列などは lxml が受け付けない
+            print("⚠ lxml での抽出に失敗したので BeautifulSoup で取り直します:", e)
+
+    from bs4 import BeautifulSoup
+
+    return BeautifulSoup(html_text, "html.parser").get_text(separator="\n")
+
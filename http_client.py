@@ -0,0 +1,142 @@
+"""
+外部への HTTP 呼び出しで共有するコネクションプール。
+
+検索API・ページ取得・OpenRouter・法人番号サイトへのリクエストは
+すべて get_session() の Session を通す。
+同じホストへの keep-alive 接続を使い回すので、毎回の TCP/TLS ハンドシェイクがなくなる。
+"""
+import codecs
+import os
+import threading
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# ホストごとのプールをいくつ保持するか
+HTTP_POOL_CONNECTIONS = int(os.environ.get("HTTP_POOL_CONNECTIONS", 32))
+# 1ホストあたりの keep-alive 接続数（gunicorn のスレッド数以上にしておく）
+HTTP_POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", 16))
+
+# ページ取得で読む最大バイト数（これを超えた分は捨てる）
+PAGE_MAX_BYTES = int(os.environ.get("PAGE_MAX_BYTES", 2 * 1024 * 1024))
+# 本文を読みにいく Content-Type（空の場合も読む）
+HTML_CONTENT_TYPES = (
+    "text/html",
+    "application/xhtml+xml",
+    "text/plain",
+)
+_CHUNK_SIZE = 64 * 1024
+
+try:
+    import brotli  # noqa: F401  urllib3 が br の展開に使う
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    ACCEPT_ENCODING = "gzip, deflate"
+
+
+class _NoCookiePolicy(DefaultCookiePolicy):
+    """
+    Session を全リクエストで共有するので、サイト間で Cookie を持ち回らないようにする。
+    """
+
+    def set_ok(self, cookie, request):
+        return False
+
+    def return_ok(self, cookie, request):
+        return False
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _build_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+    session.cookies.set_policy(_NoCookiePolicy())
+    return session
+
+
+def get_session():
+    """
+    プロセス共通の Session を返す（初回呼び出し時に作る）。
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+class UnsupportedContentType(Exception):
+    """
+    PDF や画像など、テキスト化しない Content-Type だったことを表す。
+    """
+
+
+def stream_html(url, headers=None, timeout=10, max_bytes=PAGE_MAX_BYTES):
+    """
+    ページを stream=True で取得し、(response, html_text) を返す。
+
+    - 2xx 以外（304 を含む）は本文を読まずに html_text="" で返す
+    - Content-Type が HTML でなければ本文を読む前に UnsupportedContentType
+    - 本文は max_bytes までしか読まない
+    - 文字コードがヘッダー・<meta> から決まれば、受信しながらデコードする
+    """
+    from html_text import detect_encoding, sniff_encoding
+
+    res = get_session().get(url, headers=headers, timeout=timeout, stream=True)
+    try:
+        if not 200 <= res.status_code < 300:
+            return res, ""
+
+        content_type = res.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        if content_type and content_type not in HTML_CONTENT_TYPES:
+            raise UnsupportedContentType(f"HTML ではないのでスキップ: {content_type}")
+
+        decoder = None
+        sniffed = False  # 文字コードの判定を終えたか
+        parts = []       # デコード済みの文字列
+        pending = []     # 文字コードが決まらなかった bytes
+        received = 0
+
+        for chunk in res.iter_content(chunk_size=_CHUNK_SIZE):
+            if received + len(chunk) > max_bytes:
+                chunk = chunk[:max_bytes - received]
+            received += len(chunk)
+
+            if decoder is not None:
+                parts.append(decoder.decode(chunk))
+            else:
+                pending.append(chunk)
+                if not sniffed and (received >= 4096 or received >= max_bytes):
+                    sniffed = True
+                    head = b"".join(pending)
+                    encoding = sniff_encoding(head, res.headers)
+                    if encoding is not None:
+                        decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+                        parts.append(decoder.decode(head))
+                        pending = []
+
+            if received >= max_bytes:
+                print(f"[stream_html] {max_bytes} バイトで打ち切り: {url}")
+                break
+
+        if decoder is not None:
+            parts.append(decoder.decode(b"", final=True))
+            return res, "".join(parts)
+
+        # 4KB 未満の小さいページ、またはヘッダーにも <meta> にも文字コードがなかった
+        # → 全体から判定
+        content = b"".join(pending)
+        return res, content.decode(detect_encoding(content, res.headers), errors="replace")
+    finally:
+        res.close()
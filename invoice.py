@@ -0,0 +1,137 @@
+"""
+ページ本文からインボイス登録番号（T + 13桁）をルールベースで抜き出す。
+
+- 「登録番号」「インボイス」「適格請求書発行事業者」などのキーワードの近くにある T番号だけを候補にする
+- 13桁は法人番号と同じチェックデジットで検証する
+- 店名・法人名の近くにある有効な番号がちょうど1つなら、それを返す
+
+あいまいな場合は None を返すので、呼び出し側で従来どおり LLM に任せる。
+"""
+import re
+import unicodedata
+
+# 法人格の表記（名前の照合で「株式会社」などを外した形も使う）
+from normalize import CORP_FORMS
+
+INVOICE_KEYWORDS = [
+    "登録番号",
+    "インボイス",
+    "適格請求書発行事業者",
+    "適格請求書",
+    "適格事業者",
+]
+
+# T と数字の間や、数字の途中のスペース・ハイフンは許す（"T 1234-5678-90123" など）
+_T_NUMBER_RE = re.compile(r"T[\s\-]?((?:\d[\s\-]?){12}\d)(?!\d)")
+
+# キーワードとの距離（文字数）
+KEYWORD_WINDOW = 80
+# 店名・法人名との距離（文字数）
+NAME_WINDOW = 400
+
+
+def normalize_text(text):
+    """
+    全角英数字・記号を半角にそろえる（"Ｔ１２３" → "T123"、"－" → "-"）。
+    """
+    text = unicodedata.normalize("NFKC", text)
+    return text.replace("ー", "-").replace("‐", "-").replace("−", "-")
+
+
+def is_valid_corporate_number(digits):
+    """
+    13桁の番号のチェックデジット（先頭1桁）を検証する。
+    チェックデジット = 9 - (Σ P_n × Q_n を 9 で割った余り)
+      P_n: 残り12桁の下から n 桁目 / Q_n: n が奇数なら1、偶数なら2
+    """
+    if len(digits) != 13 or not digits.isdigit():
+        return False
+
+    base = digits[1:]
+    total = 0
+    for n, d in enumerate(reversed(base), start=1):
+        total += int(d) * (1 if n % 2 == 1 else 2)
+
+    return int(digits[0]) == 9 - (total % 9)
+
+
+def _name_variants(names):
+    variants = []
+    for name in names:
+        if not name or name == "False":
+            continue
+        name = normalize_text(name).replace(" ", "").replace("　", "")
+        variants.append(name)
+
+        core = name
+        for form in CORP_FORMS:
+            core = core.replace(form, "")
+        if core and core != name and len(core) >= 2:
+            variants.append(core)
+    return variants
+
+
+def _positions(text, words):
+    result = []
+    for word in words:
+        start = text.find(word)
+        while start != -1:
+            result.append(start)
+            start = text.find(word, start + 1)
+    return result
+
+
+def _near(pos, positions, window):
+    return any(abs(pos - p) <= window for p in positions)
+
+
+def find_invoice_candidates(text, names):
+    """
+    1ページ分の本文から、キーワードと店名/法人名の両方の近くにある
+    有効なインボイス番号（"T" + 13桁）の集合を返す。
+    """
+    text = normalize_text(text)
+    # 名前の照合用にスペースを詰めた本文も使う（位置は近似でよい）
+    compact = text.replace(" ", "").replace("　", "")
+
+    keyword_pos = _positions(text, INVOICE_KEYWORDS)
+    if not keyword_pos:
+        return set()
+
+    name_pos = _positions(text, _name_variants(names))
+    compact_name_pos = _positions(compact, _name_variants(names))
+    if not name_pos and not compact_name_pos:
+        return set()
+
+    candidates = set()
+    for m in _T_NUMBER_RE.finditer(text):
+        digits = re.sub(r"\D", "", m.group(1))
+        if not is_valid_corporate_number(digits):
+            continue
+
+        pos = m.start()
+        if not _near(pos, keyword_pos, KEYWORD_WINDOW):
+            continue
+        # 詰めた本文では位置がずれるので、窓を広めにとっている
+        if not (_near(pos, name_pos, NAME_WINDOW) or _near(pos, compact_name_pos, NAME_WINDOW)):
+            continue
+
+        candidates.add("T" + digits)
+
+    return candidates
+
+
+def extract_invoice_number(pages, names):
+    """
+    pages: page_get の戻り値（[{"url":..., "text":...}, ...]）
+    names: 店名・法人名の候補
+
+    全ページを通して有効な候補がちょうど1つならそれを返す。0件・複数件なら None。
+    """
+    candidates = set()
+    for p in pages:
+        candidates |= find_invoice_candidates(p.get("text") or "", names)
+
+    if len(candidates) == 1:
+        return candidates.pop()
+    return None
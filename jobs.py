@@ -0,0 +1,108 @@
+"""
+時間のかかる処理（ResearchAI.run など）をバックグラウンドで実行するジョブ管理。
+
+submit() はすぐにジョブIDを返し、処理は専用のスレッドプールで進む。
+状態は get() で確認できる。ジョブはプロセスのメモリ上にしか持たないので、
+gunicorn の --workers 1 構成を前提にしている。
+"""
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_MAX_WORKERS = int(os.environ.get("JOB_MAX_WORKERS", 8))
+# 終了したジョブの結果を何秒残すか
+JOB_TTL = int(os.environ.get("JOB_TTL", 3600))
+
+
+class Job:
+    def __init__(self, kind):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = "queued"   # queued / running / done / error
+        self.stage = None        # 実行中のステップ名
+        self.progress = {}       # 件数など、処理ごとの進捗
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def report(self, stage=None, **progress):
+        """
+        実行中の処理から進捗を更新する。
+        """
+        if stage is not None:
+            self.stage = stage
+        self.progress.update(progress)
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": self.progress,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    def __init__(self, max_workers=JOB_MAX_WORKERS, ttl=JOB_TTL):
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind, fn, *args, **kwargs):
+        """
+        fn(*args, job=job, **kwargs) をバックグラウンドで実行する。
+        fn は job.report(...) で進捗を報告できる。
+        """
+        self._cleanup()
+
+        job = Job(kind)
+        with self._lock:
+            self._jobs[job.id] = job
+
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def counts(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return counts
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            job.result = fn(*args, job=job, **kwargs)
+            job.status = "done"
+        except Exception as e:
+            print(f"⚠ ジョブ {job.id} が失敗: {e}")
+            job.error = str(e)
+            job.status = "error"
+        finally:
+            job.finished_at = time.time()
+
+    def _cleanup(self):
+        now = time.time()
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job.finished_at is not None and now - job.finished_at > self.ttl
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
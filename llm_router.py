@@ -0,0 +1,260 @@
+"""
+LLM 呼び出しのモデル振り分け（フォールバックとヘッジ）。
+
+- LLM_MODELS の順にモデルを使う。429 / 5xx / タイムアウト / JSON でない返答なら次のモデルに回す
+- 最初のモデルの応答が、そのモデルの過去の応答時間の LLM_HEDGE_PERCENTILE パーセンタイルを
+  超えても返ってこなければ、待ったまま次のモデルにも同じリクエストを送る（ヘッジ）
+- 先に返ってきた「JSON として読める返答」を採用する
+- モデルごとの応答時間・採用率を ModelStats に残す（/api/llm/stats で確認してモデルの並びを調整する）
+
+モデルが1つだけのときは、ヘッジもフォールバックもしない（同じプロバイダー・同じレート制限に
+同じリクエストを重ねて送るだけになるため）。LLM_HEDGE_SAME_MODEL=1 なら、同じモデルにもう1回送る。
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# 優先順のモデル（カンマ区切り）
+LLM_MODELS = [m.strip() for m in os.environ.get("LLM_MODELS", "openai/gpt-oss-20b:free").split(",") if m.strip()]
+# 1回の呼び出しのタイムアウト（秒）
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", 90))
+# 同時に送るのは最大何モデルまでか（1 ならヘッジせず、失敗したときだけ次のモデルに回す）
+LLM_MAX_PARALLEL = int(os.environ.get("LLM_MAX_PARALLEL", 2))
+# 最初のモデルが、過去の応答時間のこのパーセンタイルを超えたらヘッジする
+LLM_HEDGE_PERCENTILE = float(os.environ.get("LLM_HEDGE_PERCENTILE", 90))
+# 応答時間の記録が少ないうちのヘッジまでの待ち時間（秒）
+LLM_HEDGE_DELAY = float(os.environ.get("LLM_HEDGE_DELAY", 20))
+LLM_HEDGE_MIN_DELAY = float(os.environ.get("LLM_HEDGE_MIN_DELAY", 2))
+# モデルが1つのとき、同じモデルへのもう1回をヘッジ・フォールバック先にするか
+LLM_HEDGE_SAME_MODEL = os.environ.get("LLM_HEDGE_SAME_MODEL", "0") == "1"
+# パーセンタイルの計算に使う直近の件数と、計算を始める最小件数
+LATENCY_WINDOW = 200
+LATENCY_MIN_SAMPLES = 20
+
+LLM_ROUTER_MAX_WORKERS = int(os.environ.get("LLM_ROUTER_MAX_WORKERS", 32))
+
+
+class LLMError(Exception):
+    """
+    LLM API がエラーを返した。status が 401 / 403 のとき（と fatal=True のとき）は、
+    ほかのモデルに回しても同じなのですぐ諦める。
+    """
+
+    def __init__(self, message, status=None, retry_after=None, fatal=False):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        self._fatal = fatal
+
+    @property
+    def fatal(self):
+        return self._fatal or self.status in (401, 403)
+
+
+def is_json_response(text):
+    """
+    LLM の返答が JSON として読めるか（読めない返答は採用もキャッシュもしない）。
+    """
+    try:
+        json.loads(text)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+class ModelStats:
+    def __init__(self, model):
+        self.model = model
+        self.latencies = deque(maxlen=LATENCY_WINDOW)  # 成功した呼び出しの応答時間
+        self.calls = 0
+        self.errors = 0
+        self.invalid = 0   # 200 だが JSON ではなかった
+        self.wins = 0      # その返答が採用された
+        self.hedges = 0    # ヘッジとして送られた
+        self._lock = threading.Lock()
+
+    def add_win(self):
+        with self._lock:
+            self.wins += 1
+
+    def add_hedge(self):
+        with self._lock:
+            self.hedges += 1
+
+    def record(self, seconds, ok, valid=True):
+        with self._lock:
+            self.calls += 1
+            if not ok:
+                self.errors += 1
+                return
+            self.latencies.append(seconds)
+            if not valid:
+                self.invalid += 1
+
+    def percentile(self, p):
+        with self._lock:
+            values = sorted(self.latencies)
+        if len(values) < LATENCY_MIN_SAMPLES:
+            return None
+        k = min(len(values) - 1, int(len(values) * p / 100))
+        return values[k]
+
+    def to_dict(self):
+        p50 = self.percentile(50)
+        p90 = self.percentile(90)
+        p99 = self.percentile(99)
+        with self._lock:
+            calls = self.calls
+            return {
+                "model": self.model,
+                "calls": calls,
+                "errors": self.errors,
+                "invalid": self.invalid,
+                "wins": self.wins,
+                "hedges": self.hedges,
+                "win_rate": self.wins / calls if calls else None,
+                "p50": p50,
+                "p90": p90,
+                "p99": p99,
+            }
+
+
+class ModelRouter:
+    def __init__(self, max_parallel=LLM_MAX_PARALLEL, hedge_percentile=LLM_HEDGE_PERCENTILE):
+        self.max_parallel = max(1, max_parallel)
+        self.hedge_percentile = hedge_percentile
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=LLM_ROUTER_MAX_WORKERS, thread_name_prefix="llm")
+
+    def stats_for(self, model):
+        with self._lock:
+            stats = self._stats.get(model)
+            if stats is None:
+                stats = self._stats[model] = ModelStats(model)
+            return stats
+
+    def hedge_delay(self, model):
+        p = self.stats_for(model).percentile(self.hedge_percentile)
+        if p is None:
+            return LLM_HEDGE_DELAY
+        return max(LLM_HEDGE_MIN_DELAY, p)
+
+    def _attempt(self, send, model, timeout, validate, slot):
+        # 応答時間は送り出してから測る（待ち行列で待った時間は含めない）
+        start = time.perf_counter()
+        try:
+            content = send(model, timeout, slot)
+        except Exception:
+            self.stats_for(model).record(time.perf_counter() - start, ok=False)
+            raise
+        valid = validate is None or validate(content)
+        self.stats_for(model).record(time.perf_counter() - start, ok=True, valid=valid)
+        return content, valid
+
+    def call(self, models, send, timeout=LLM_TIMEOUT, validate=is_json_response, admit=None, rate_limit_retries=0):
+        """
+        send(model, timeout, slot) -> content を models の順に試し、採用した (content, model) を返す。
+        JSON として読める返答が1つもなければ、最初に返ってきた返答をそのまま返す
+        （返答を読めるかどうかは呼び出し側がいままでどおり判断する）。
+        すべて失敗したら最後の例外を投げる。
+
+        admit(hedge) は送り出す前に呼び出し元のスレッドで呼ぶ（llm_scheduler の順番待ち）。
+        戻り値の slot は send に渡し、release(used=None) を持つこと。
+        ヘッジのときは待たずに None を返してよく、そのときはヘッジしない。
+        429 で残りのモデルがなければ、rate_limit_retries 回まで同じモデルに送り直す。
+        """
+        queue = list(dict.fromkeys(models or LLM_MODELS))
+        if len(queue) == 1 and LLM_HEDGE_SAME_MODEL and self.max_parallel > 1:
+            # 明示的に有効にしたときだけ、同じモデルへのもう1回をヘッジ・フォールバック先にする
+            queue.append(queue[0])
+
+        running = {}  # future -> (model, slot)
+        fallback = None
+        last_error = None
+        retries = 0
+        hedge_at = None
+
+        def launch(hedge=False):
+            nonlocal hedge_at
+            slot = admit(hedge) if admit is not None else None
+            if hedge and admit is not None and slot is None:
+                # キーに空きがないときはヘッジしない（混んでいるキーに重ねて送らない）
+                return None
+            model = queue.pop(0)
+            if hedge:
+                self.stats_for(model).add_hedge()
+            future = self._executor.submit(self._attempt, send, model, timeout, validate, slot)
+            running[future] = (model, slot)
+            hedge_at = time.monotonic() + self.hedge_delay(model)
+            return model
+
+        try:
+            launch()
+            while running:
+                # 同時に送れる数に余裕があるあいだは、最後に送ったモデルのヘッジの時刻まで待つ
+                can_hedge = queue and len(running) < self.max_parallel
+                wait_for = max(0.0, hedge_at - time.monotonic()) if can_hedge else None
+                done, _ = wait(list(running), timeout=wait_for, return_when=FIRST_COMPLETED)
+
+                if not done:
+                    model = launch(hedge=True)
+                    if model is None:
+                        hedge_at = time.monotonic() + self.hedge_delay(queue[0])
+                    else:
+                        print(f"[ModelRouter] 応答が遅いので {model} にも送ります")
+                    continue
+
+                failed = 0
+                for future in done:
+                    model, _ = running.pop(future)
+                    try:
+                        content, valid = future.result()
+                    except LLMError as e:
+                        last_error = e
+                        if e.fatal:
+                            raise
+                        print(f"[ModelRouter] {model} が失敗: {e}")
+                        if e.status == 429 and not queue and retries < rate_limit_retries:
+                            # 待ち時間は admit が面倒を見る（キーは Retry-After のあいだ止まっている）
+                            retries += 1
+                            queue.append(model)
+                        failed += 1
+                        continue
+                    except Exception as e:
+                        last_error = e
+                        print(f"[ModelRouter] {model} が失敗: {e}")
+                        failed += 1
+                        continue
+
+                    if valid:
+                        self.stats_for(model).add_win()
+                        return content, model
+                    if fallback is None:
+                        fallback = (content, model)
+                    failed += 1
+
+                # 失敗・JSON でない返答の分だけ、次のモデルに回す
+                for _ in range(failed):
+                    if queue and len(running) < self.max_parallel:
+                        launch()
+        finally:
+            # まだ送り出していない負けた試行は取り消し、枠を返す（送信中のものは止められない）
+            for future, (model, slot) in running.items():
+                if future.cancel() and slot is not None:
+                    slot.release()
+
+        if fallback is not None:
+            return fallback
+        raise last_error or LLMError("LLM を呼べるモデルがありません")
+
+    def stats(self):
+        with self._lock:
+            models = list(self._stats.values())
+        return [s.to_dict() for s in models]
+
+
+router = ModelRouter()
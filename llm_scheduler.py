@@ -0,0 +1,356 @@
+"""
+LLM API の呼び出しを API キーごとに流量制限するスケジューラ。
+
+同じ OpenRouter のキーを多数の run が同時に使うので、キーごとに
+
+- トークンバケット2つ（1分あたりのリクエスト数 LLM_RPM / トークン数 LLM_TPM）
+- 同時実行数の上限（LLM_MAX_CONCURRENT）
+- 優先度つきの待ち行列（PRIORITY_HIGH → NORMAL → LOW、同じ優先度なら先着順）
+
+で送り出しを揃える。429 が返ったら Retry-After（なければ指数バックオフ）のあいだキー全体を止め、
+バケットを空にしてから再開する（止まっていた分を一斉に送り直して、また 429 になるのを避ける）。
+レスポンスの usage で実際に使ったトークン数がわかれば、見積もりとの差をバケットで精算する。
+
+順番待ちは llm_router に渡す admit で、呼び出し元のスレッドで行う（admission を参照）。
+llm_router のスレッドプールの中では待たないので、優先度の高い呼び出しが低い呼び出しの後ろで詰まらない。
+
+上限は既定ではかけない（429 の待ちだけ行う）。プロバイダーの上限がわかっているキーでは
+LLM_RPM / LLM_TPM / LLM_MAX_CONCURRENT を設定する（例: OpenRouter の無料モデルは LLM_RPM=20）。
+"""
+import email.utils
+import hashlib
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+
+from llm_router import LLMError
+
+# キーごとの 1分あたりのリクエスト数・トークン数の上限（0 なら制限しない）
+LLM_RPM = float(os.environ.get("LLM_RPM", 0))
+LLM_TPM = float(os.environ.get("LLM_TPM", 0))
+# キーごとの同時実行数の上限（0 なら制限しない）
+LLM_MAX_CONCURRENT = int(os.environ.get("LLM_MAX_CONCURRENT", 0))
+# 429 のときに同じモデルへ送り直す回数（ほかのモデルが残っていればそちらに回す）
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 4))
+# Retry-After がないときのバックオフ（秒）: BASE * 2^n（最大 MAX）にジッターをかける
+LLM_BACKOFF_BASE = float(os.environ.get("LLM_BACKOFF_BASE", 2))
+LLM_BACKOFF_MAX = float(os.environ.get("LLM_BACKOFF_MAX", 60))
+# 待ち行列で待つ最大時間（秒）。超えたら送り直さずにエラーにする
+LLM_QUEUE_TIMEOUT = float(os.environ.get("LLM_QUEUE_TIMEOUT", 300))
+# トークン数の見積もり: 入力の文字数 / LLM_CHARS_PER_TOKEN + 出力の見込み
+LLM_CHARS_PER_TOKEN = float(os.environ.get("LLM_CHARS_PER_TOKEN", 2))
+LLM_EXPECTED_OUTPUT_TOKENS = int(os.environ.get("LLM_EXPECTED_OUTPUT_TOKENS", 500))
+
+PRIORITY_HIGH = 0    # API の同期呼び出し（/api/run）
+PRIORITY_NORMAL = 1  # ジョブ
+PRIORITY_LOW = 2     # 一括処理・シートの同期
+
+
+def estimate_tokens(*texts):
+    chars = sum(len(t or "") for t in texts)
+    return int(chars / LLM_CHARS_PER_TOKEN) + LLM_EXPECTED_OUTPUT_TOKENS
+
+
+def parse_retry_after(value):
+    """
+    Retry-After（秒数または HTTP 日付）を待ち秒数にする。読めなければ None。
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when is None:
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def retry_after_from_headers(headers):
+    """
+    429 のレスポンスヘッダから待ち時間を取り出す。
+    Retry-After がなければ X-RateLimit-Reset（OpenRouter はミリ秒の UNIX 時刻）を使う。
+    """
+    retry_after = headers.get("Retry-After")
+    if retry_after is not None:
+        return retry_after
+    reset = headers.get("X-RateLimit-Reset")
+    try:
+        reset = float(reset)
+    except (TypeError, ValueError):
+        return None
+    if reset > 1e12:
+        reset /= 1000
+    return max(0.0, reset - time.time())
+
+
+class TokenBucket:
+    """
+    1分あたり per_minute 個補充されるバケット（最大 per_minute 個）。per_minute <= 0 なら無制限。
+    """
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        if self.tokens < self.capacity:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    def wait_time(self, n, now):
+        """
+        n 個取れるまでの秒数（0 ならすぐ取れる）。
+        """
+        if self.per_minute <= 0:
+            return 0.0
+        self._refill(now)
+        # 容量を超える要求は、満杯になれば通す（いつまでも待たないように）
+        n = min(n, self.capacity)
+        if self.tokens >= n:
+            return 0.0
+        return (n - self.tokens) * 60 / self.per_minute
+
+    def take(self, n):
+        if self.per_minute > 0:
+            self.tokens -= min(n, self.capacity)
+
+    def adjust(self, n):
+        # 見積もりとの差の精算（マイナスになれば、その分だけ後の送信が待つ）
+        if self.per_minute > 0:
+            self.tokens = min(self.capacity, self.tokens - n)
+
+    def drain(self, now):
+        if self.per_minute > 0:
+            self._refill(now)
+            self.tokens = min(self.tokens, 0)
+
+
+class KeyLimiter:
+    """
+    1つの API キーの待ち行列と流量制限。
+    """
+
+    def __init__(self, name, rpm, tpm, max_concurrent):
+        self.name = name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_concurrent = max_concurrent
+        self.active = 0
+        self.blocked_until = 0.0
+        self.streak = 0  # 続けて 429 を受けた回数（バックオフの長さに使う）
+        self._queue = []  # (priority, seq)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        # 統計
+        self.sent = 0
+        self.throttled = 0
+        self.hedges_skipped = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+
+    def _ready_in(self, tokens, now):
+        return max(
+            self.blocked_until - now,
+            self.requests.wait_time(1, now),
+            self.tokens.wait_time(tokens, now),
+            0.0,
+        )
+
+    def _has_room(self):
+        return self.max_concurrent <= 0 or self.active < self.max_concurrent
+
+    def _take(self, tokens, now, start):
+        self.requests.take(1)
+        self.tokens.take(tokens)
+        self.active += 1
+        self.sent += 1
+        self.wait_seconds += now - start
+
+    def try_acquire(self, tokens):
+        """
+        待たずに送れるときだけ枠を取る（ヘッジ用）。待っている呼び出しがあれば追い越さない。
+        """
+        with self._cond:
+            now = time.monotonic()
+            if not self._queue and self._has_room() and self._ready_in(tokens, now) <= 0:
+                self._take(tokens, now, now)
+                return True
+            self.hedges_skipped += 1
+            return False
+
+    def ticket(self):
+        with self._cond:
+            return next(self._seq)
+
+    def acquire(self, tokens, priority, timeout, ticket=None):
+        """
+        順番と流量制限の許しが出るまで待つ。timeout 秒を超えたら False。
+        ticket を渡すと、その番号の順番で並ぶ（送り直しのときに最後尾に回らないように）。
+        """
+        start = time.monotonic()
+        deadline = start + timeout
+        with self._cond:
+            entry = (priority, next(self._seq) if ticket is None else ticket)
+            heapq.heappush(self._queue, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    if now >= deadline:
+                        self.timeouts += 1
+                        return False
+                    wait_for = deadline - now
+                    # 先頭の1件だけが送り出せる（後ろの優先度の低いものが追い越さない）
+                    if self._queue[0] == entry and self._has_room():
+                        ready_in = self._ready_in(tokens, now)
+                        if ready_in <= 0:
+                            self._take(tokens, now, start)
+                            return True
+                        wait_for = min(wait_for, ready_in)
+                    self._cond.wait(wait_for)
+            finally:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                # 次の先頭に順番が回ったことを知らせる
+                self._cond.notify_all()
+
+    def release(self, estimated, used=None, ok=True):
+        with self._cond:
+            self.active -= 1
+            if used is not None:
+                self.tokens.adjust(used - estimated)
+            if ok:
+                self.streak = 0
+            self._cond.notify_all()
+
+    def block(self, seconds):
+        """
+        429 を受けたので seconds 秒キー全体を止める。再開後は補充された分だけ送る。
+        """
+        with self._cond:
+            now = time.monotonic()
+            self.throttled += 1
+            self.streak += 1
+            self.blocked_until = max(self.blocked_until, now + seconds)
+            self.requests.drain(now)
+            self.tokens.drain(now)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            now = time.monotonic()
+            return {
+                "key": self.name,
+                "queued": len(self._queue),
+                "active": self.active,
+                "blocked_for": max(0.0, self.blocked_until - now),
+                "sent": self.sent,
+                "throttled": self.throttled,
+                "hedges_skipped": self.hedges_skipped,
+                "queue_timeouts": self.timeouts,
+                "avg_wait": self.wait_seconds / self.sent if self.sent else None,
+            }
+
+
+class Slot:
+    """
+    送り出しを許された1回分の枠。送信が終わったら必ず release() する（2回呼んでもよい）。
+    """
+
+    def __init__(self, scheduler, limiter, tokens):
+        self._scheduler = scheduler
+        self._limiter = limiter
+        self.tokens = tokens
+        self._throttled = False
+        self._released = False
+        self._lock = threading.Lock()
+
+    def throttle(self, retry_after=None):
+        """
+        429 を受けた。Retry-After（なければバックオフ）のあいだキー全体を止める。
+        """
+        self._throttled = True
+        seconds = self._scheduler.backoff(self._limiter.streak, retry_after)
+        print(f"[LLMScheduler] 429 を受けたので {seconds:.1f} 秒このキーの送信を止めます")
+        self._limiter.block(seconds)
+
+    def release(self, used=None):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._limiter.release(self.tokens, used, ok=not self._throttled)
+
+
+class LLMScheduler:
+    def __init__(self, rpm=LLM_RPM, tpm=LLM_TPM, max_concurrent=LLM_MAX_CONCURRENT,
+                 max_retries=LLM_MAX_RETRIES, queue_timeout=LLM_QUEUE_TIMEOUT):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_concurrent = max_concurrent
+        self.max_retries = max_retries
+        self.queue_timeout = queue_timeout
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, api_key):
+        # キーそのものは持たず、ハッシュの先頭で区別する（stats にもこれを出す）
+        name = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:12]
+        with self._lock:
+            limiter = self._limiters.get(name)
+            if limiter is None:
+                limiter = self._limiters[name] = KeyLimiter(name, self.rpm, self.tpm, self.max_concurrent)
+            return limiter
+
+    def backoff(self, attempt, retry_after=None):
+        seconds = parse_retry_after(retry_after)
+        if seconds is not None:
+            return seconds
+        # 半分は必ず待ち、残り半分にジッターをかける（同時に 429 を受けた呼び出しが揃って戻らないように）
+        delay = min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def admission(self, api_key, tokens=0, priority=PRIORITY_NORMAL):
+        """
+        llm_router.ModelRouter.call に渡す admit(hedge) を返す。
+        1回の chat の中の送り出し（フォールバック・429 の送り直し）は同じ順番で並ぶ。
+        ヘッジは待たずに送れるときだけ枠を取り、取れなければ None（ヘッジしない）。
+        """
+        limiter = self.limiter(api_key)
+        ticket = limiter.ticket()
+
+        def admit(hedge=False):
+            if hedge:
+                return Slot(self, limiter, tokens) if limiter.try_acquire(tokens) else None
+            if not limiter.acquire(tokens, priority, self.queue_timeout, ticket):
+                raise LLMError(
+                    f"LLM の待ち行列で {self.queue_timeout:.0f} 秒待っても順番が来ませんでした",
+                    status="queue_timeout",
+                    fatal=True,
+                )
+            return Slot(self, limiter, tokens)
+
+        return admit
+
+    def stats(self):
+        with self._lock:
+            limiters = list(self._limiters.values())
+        return {
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            "max_concurrent": self.max_concurrent,
+            "keys": [l.stats() for l in limiters],
+        }
+
+
+scheduler = LLMScheduler()
@@ -1,11 +1,45 @@
-from selenium import webdriver
-from bs4 import BeautifulSoup
-import requests
+import time
+
+# import にかかった時間を /metrics に出す（コールドスタートの計測用）
+_IMPORT_STARTED = time.perf_counter()
+
 import json
-import requests, re
-from lxml import html
-from flask import Flask, request, jsonify
+import re
+from flask import Flask, Response, g, request, jsonify
 import os
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from cache import create_cache
+from http_client import get_session, stream_html
+from invoice import extract_invoice_number as find_invoice_number
+from jobs import JobManager
+from llm_router import LLM_MODELS, LLMError, is_json_response
+from llm_router import router as llm_router
+from llm_scheduler import PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL, estimate_tokens, retry_after_from_headers
+from llm_scheduler import scheduler as llm_scheduler
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from metrics import REGISTRY, Counter, Gauge, Histogram
+from normalize import corp_name_key, parse_address, shop_key
+from nta_index import open_default_index
+from page_cache import create_default_page_cache
+from relevance import build_anchors, filter_pages, select_relevant
+from result_store import create_result_store
+from sheets import (
+    SHEET_SYNC_MAX_WORKERS,
+    SyncCheckpoint,
+    get_writer,
+    is_sync_running,
+    sheet_clients,
+    sync_sheet,
+    writer_stats,
+)
+from singleflight import SingleFlight
+from startup import start_warmup
 
 
 HEADERS = {
@@ -15,21 +49,209 @@ HEADERS = {
         "Chrome/124.0.0.0 Safari/537.36"
     )
 }
+
+# ========== メトリクス（/metrics で公開） ==========
+# stage: search / page_fetch / html_parse / llm / nta_lookup / STEP1〜STEP5
+STAGE_SECONDS = Histogram(
+    "research_stage_seconds", "ResearchAI の各ステージの所要時間（秒）", ["stage", "route"]
+)
+RUN_SECONDS = Histogram("research_run_seconds", "ResearchAI.run 全体の所要時間（秒）", ["route"])
+STAGE_ERRORS = Counter("research_stage_errors_total", "ステージで発生したエラーの数", ["stage"])
+RUNS_IN_FLIGHT = Gauge("research_runs_in_flight", "実行中の ResearchAI.run の数")
+LLM_SECONDS = Histogram(
+    "llm_request_seconds", "OpenRouter API の応答時間（秒）", ["model", "status"]
+)
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "処理中の HTTP リクエスト数", ["endpoint"])
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP リクエスト数", ["endpoint", "status"])
+HTTP_SECONDS = Histogram("http_request_seconds", "HTTP リクエストの処理時間（秒）", ["endpoint"])
+RELEVANCE_PAGES = Counter(
+    "relevance_pages_total", "LLM の前の点数付けで残した／落としたページ数", ["stage", "decision"]
+)
+LLM_SKIPPED = Counter("llm_calls_skipped_total", "対象店舗のページがなく LLM を呼ばなかった回数", ["stage"])
+STARTUP_SECONDS = Gauge("app_startup_seconds", "起動処理の所要時間（秒）", ["phase"])
+
+# 外部サービスの URL（ベンチマークではローカルの代替サーバーに向ける）
+SEARCH_URL = os.environ.get("SEARCH_URL", "https://ecosia1-477268798017.europe-west1.run.app/search")
+OPENROUTER_URL = os.environ.get("OPENROUTER_URL", "https://openrouter.ai/api/v1/chat/completions")
+NTA_URL = os.environ.get("NTA_URL", "https://www.houjin-bangou.nta.go.jp/henkorireki-johoto.html")
+SEARCH_TIMEOUT = float(os.environ.get("SEARCH_TIMEOUT", 20))
+
+# ========== 検索結果キャッシュ ==========
+# (query, top_n) -> links。SEARCH_CACHE_DB を指定すると SQLite にも保存して再起動後も使う
+SEARCH_CACHE_TTL = int(os.environ.get("SEARCH_CACHE_TTL", 24 * 3600))
+SEARCH_CACHE_SIZE = int(os.environ.get("SEARCH_CACHE_SIZE", 4096))
+SEARCH_CACHE_DB = os.environ.get("SEARCH_CACHE_DB", "")
+
+search_cache = create_cache(
+    SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL, sqlite_path=SEARCH_CACHE_DB, table="search_cache"
+)
+
+# ========== ページ取得の並列設定 ==========
+# PAGE_FETCH_CONCURRENT=0 で従来どおりの逐次取得に戻せる
+PAGE_FETCH_CONCURRENT = os.environ.get("PAGE_FETCH_CONCURRENT", "1") != "0"
+# プロセス全体での同時取得数の上限（gunicorn の全スレッドで共有）
+PAGE_FETCH_MAX_WORKERS = int(os.environ.get("PAGE_FETCH_MAX_WORKERS", 8))
+# 同一ホストへの同時接続数の上限
+PAGE_FETCH_PER_HOST = int(os.environ.get("PAGE_FETCH_PER_HOST", 2))
+
+# 1ページから取り出す本文の上限。LLM に渡す分は relevance.select_relevant でさらに絞る
+PAGE_TEXT_MAX_CHARS = int(os.environ.get("PAGE_TEXT_MAX_CHARS", 100000))
+
+# 取得に失敗しても「一時的な失敗」とみなさないステータス（ページがないだけ）
+PERMANENT_FETCH_ERRORS = (404, 410)
+
+# ページ本文のディスクキャッシュ（PAGE_CACHE_DIR="" で無効）
+page_cache = create_default_page_cache()
+
+_fetch_executor = ThreadPoolExecutor(
+    max_workers=PAGE_FETCH_MAX_WORKERS, thread_name_prefix="page_fetch"
+)
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+
+def _host_semaphore(url):
+    """
+    URL のホストごとのセマフォを返す（なければ作る）。
+    """
+    host = urlparse(url).netloc.lower()
+    with _host_semaphores_lock:
+        sem = _host_semaphores.get(host)
+        if sem is None:
+            sem = threading.BoundedSemaphore(PAGE_FETCH_PER_HOST)
+            _host_semaphores[host] = sem
+    return sem
+
+
+# ========== 法人番号インデックス ==========
+# nta_index.py で作った SQLite（NTA_INDEX_DB）があれば、法人番号サイトへ行く前にこちらを引く
+corp_index = open_default_index()
+
+# ========== run() の先行並列実行 ==========
+# RUN_SPECULATIVE=1 で STEP1 / STEP2 / STEP3 の探索を最初に同時に走らせる
+RUN_SPECULATIVE = os.environ.get("RUN_SPECULATIVE", "0") == "1"
+RUN_SPECULATIVE_MAX_WORKERS = int(os.environ.get("RUN_SPECULATIVE_MAX_WORKERS", 24))
+
+_branch_executor = ThreadPoolExecutor(
+    max_workers=RUN_SPECULATIVE_MAX_WORKERS, thread_name_prefix="run_branch"
+)
+
+
+class BranchCancelled(Exception):
+    """
+    先行実行していたステップが不要になり、途中で打ち切られたことを表す。
+    """
+
+
+# ========== 同時実行中の同じ処理をまとめる ==========
+# 同じ店舗の run、同じ検索クエリ、同じ法人の代表者探しが同時に来たら、1回だけ実行して結果を分け合う
+run_flight = SingleFlight("run")
+search_flight = SingleFlight("search")
+corp_rep_flight = SingleFlight("corp_representative")
+
+
+def _key_digest(api_key):
+    # 別の API キーの呼び出しとはまとめない（片方のキーのエラーがもう片方に波及しないように）
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+
+
+# ========== LLM 応答キャッシュ ==========
+# LLM_CACHE_BACKEND: memory（プロセス内LRU） / sqlite（LLM_CACHE_DB に保存） / none
+LLM_CACHE_BACKEND = os.environ.get("LLM_CACHE_BACKEND", "memory")
+LLM_CACHE_DB = os.environ.get("LLM_CACHE_DB", os.path.join(tempfile.gettempdir(), "llm_cache.sqlite3"))
+LLM_CACHE_TTL = int(os.environ.get("LLM_CACHE_TTL", 7 * 24 * 3600))
+LLM_CACHE_SIZE = int(os.environ.get("LLM_CACHE_SIZE", 2048))
+
+
+def create_llm_cache():
+    if LLM_CACHE_BACKEND == "none":
+        return None
+    if LLM_CACHE_BACKEND == "sqlite":
+        return create_cache(LLM_CACHE_SIZE, LLM_CACHE_TTL, sqlite_path=LLM_CACHE_DB, table="llm_cache")
+    return create_cache(LLM_CACHE_SIZE, LLM_CACHE_TTL)
+
+
+llm_cache = create_llm_cache()
+
+# ========== リサーチ結果ストア ==========
+# 同じ店舗の2回目以降は、保存済みの結果をそのまま返す（RESULT_STORE_BACKEND=none で無効）
+result_store = create_result_store()
+
+
 class OpenRouterClient:
-    def __init__(self, api_key: str, model: str):
+    def __init__(self, api_key: str, model: str = None, cache=llm_cache, models=None, priority=PRIORITY_NORMAL):
+        """
+        models: 優先順のモデル（省略時は model、それもなければ LLM_MODELS）。
+        2つ目以降はフォールバック・ヘッジ先として llm_router が使う。
+        priority: llm_scheduler の待ち行列での優先度（同じキーの呼び出しが混んでいるとき）
+        """
         self.api_key = api_key
-        print(self.api_key)
-        self.model = model
-        self.url = "https://openrouter.ai/api/v1/chat/completions"
+        self.models = list(models or ([model] if model else LLM_MODELS))
+        self.model = self.models[0]
+        self.cache = cache
+        self.priority = priority
+        self.url = OPENROUTER_URL
         self.headers = {
             "Authorization": f"Bearer " + self.api_key,
             "Content-Type": "application/json"
         }
 
-    def chat(self, system_prompt, user_payload):
+    def cache_key(self, system_prompt, user_content):
+        # どのモデルの返答でも採用するので、キーにはモデルの並び全体を使う
+        h = hashlib.sha256()
+        for part in (",".join(self.models), system_prompt, user_content):
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def _send(self, model, timeout, slot, system_prompt, user_content):
+        # slot は llm_scheduler が出した送信枠。429 ならキー全体を止め、終わったら枠を返す
+        used = None
+        try:
+            content, used = self._post(model, timeout, system_prompt, user_content)
+            return content
+        except LLMError as e:
+            if e.status == 429 and slot is not None:
+                slot.throttle(e.retry_after)
+            raise
+        finally:
+            if slot is not None:
+                slot.release(used)
+
+    def _post(self, model, timeout, system_prompt, user_content):
+        data = {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_content}
+            ]
+        }
+
+        start = time.perf_counter()
+        try:
+            res = get_session().post(self.url, headers=self.headers, json=data, timeout=timeout)
+        except Exception:
+            LLM_SECONDS.observe(time.perf_counter() - start, model=model, status="exception")
+            raise
+        LLM_SECONDS.observe(time.perf_counter() - start, model=model, status=str(res.status_code))
+
+        if res.status_code != 200:
+            raise LLMError(
+                f"APIエラー: {res.status_code} {res.text}",
+                status=res.status_code,
+                retry_after=retry_after_from_headers(res.headers),
+            )
+
+        body = res.json()
+        used = (body.get("usage") or {}).get("total_tokens")
+        return body["choices"][0]["message"]["content"], used
+
+    def chat(self, system_prompt, user_payload, use_cache=True, validate=is_json_response):
         """
         system_prompt: str（LLM指示）
         user_payload: dict または str（LLMに渡すデータ）
+        use_cache: False なら応答キャッシュを使わない
+        validate: 返答を採用・キャッシュしてよいか判定する関数（None なら常に採用）
         """
 
         # dict なら JSON化する
@@ -38,62 +260,214 @@ class OpenRouterClient:
         else:
             user_content = user_payload
 
-        data = {
-            "model": self.model,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_content}
-            ]
-        }
+        cache_key = None
+        if use_cache and self.cache is not None:
+            cache_key = self.cache_key(system_prompt, user_content)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                print("[OpenRouterClient] キャッシュから応答を返します")
+                return cached
 
-        res = requests.post(self.url, headers=self.headers, json=data)
+        def send(model, timeout, slot):
+            return self._send(model, timeout, slot, system_prompt, user_content)
 
-        if res.status_code != 200:
-            raise Exception(f"APIエラー: {res.status_code} {res.text}")
+        # 同じキーの呼び出しはスケジューラの順番待ち（優先度つき）を通してから送る
+        admit = llm_scheduler.admission(
+            self.api_key, tokens=estimate_tokens(system_prompt, user_content), priority=self.priority
+        )
+        content, model = llm_router.call(
+            self.models, send, validate=validate, admit=admit, rate_limit_retries=llm_scheduler.max_retries
+        )
+
+        # エラー応答やパースできない返答は覚えない
+        if cache_key is not None and (validate is None or validate(content)):
+            self.cache.set(cache_key, content)
 
-        return res.json()["choices"][0]["message"]["content"]
+        return content
 
 
 class ResearchAI:
-    def __init__(self, shopname, shopaddress,key):
+    def __init__(self, shopname, shopaddress,key, concurrent_fetch=PAGE_FETCH_CONCURRENT, progress=None,
+                 speculative=RUN_SPECULATIVE, priority=PRIORITY_NORMAL):
         # ========== 検索・LLM 初期化 ==========
 
         self.shopname = shopname
         self.shopaddress = shopaddress
+        self.concurrent_fetch = concurrent_fetch
+        # 進捗通知用のコールバック（ジョブAPIから渡される）。progress(stage) の形で呼ぶ
+        self.progress = progress
+        self.speculative = speculative
+
+        # 先行実行中のステップ: name -> (future, cancel_event)
+        self._branches = {}
+        # 先行実行スレッドごとの打ち切りフラグ
+        self._branch_local = threading.local()
+        # 検索 API のエラーやページ取得の一時的な失敗があったか（あれば「見つからなかった」結果を保存しない）
+        self.degraded = False
 
         self.api_key = key
-        self.model = "openai/gpt-oss-20b:free"
+        # 優先順のモデル（LLM_MODELS）。先頭が遅い・失敗したときは llm_router が次に回す
+        self.models = LLM_MODELS
+        self.model = self.models[0]
+
+        self.client = OpenRouterClient(self.api_key, models=self.models, priority=priority)
+
+        # 計測したステージの所要時間: [(stage, seconds), ...]（run の最後に route 付きで記録する）
+        self._spans = []
+        self._spans_lock = threading.Lock()
+        self._current_step = None
+
+    # ========== 共通：計測 ==========
+
+    @contextmanager
+    def span(self, stage):
+        """
+        with self.span("search"): ... の区間の所要時間を記録する。例外はエラー数に数える。
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except BranchCancelled:
+            raise
+        except Exception:
+            STAGE_ERRORS.inc(stage=stage)
+            raise
+        finally:
+            with self._spans_lock:
+                self._spans.append((stage, time.perf_counter() - start))
 
-        self.client = OpenRouterClient(self.api_key, self.model)
+    def chat(self, system_prompt, user_payload):
+        with self.span("llm"):
+            return self.client.chat(system_prompt, user_payload)
 
     # ========== 共通：ページ取得 ==========
 
-    def page_get(self, urls):
-        pages = []
-        for url in urls:
-            print("fetch:", url)
-            try:
-                res = requests.get(url, headers=HEADERS, timeout=10)
-                res.raise_for_status()
+    def fetch_page(self, url):
+        """
+        1ページ取得してテキスト化する。失敗したら None を返す。
+        """
+        cached = None
+        if page_cache is not None:
+            cached, fresh = page_cache.lookup(url)
+            if fresh:
+                print("fetch(cache):", url)
+                return {"url": url, "text": cached["text"]}
+
+        print("fetch:", url)
+        try:
+            headers = HEADERS
+            if cached:
+                headers = dict(HEADERS, **page_cache.conditional_headers(cached))
+
+            # 本文は PAGE_MAX_BYTES まで。HTML 以外（PDF など）は本文を読む前に諦める
+            with self.span("page_fetch"), _host_semaphore(url):
+                res, html_text = stream_html(url, headers=headers, timeout=10)
+
+            # 304 ならダウンロードもパースもせずキャッシュを使う
+            if res.status_code == 304 and cached:
+                page_cache.mark_revalidated(url, cached)
+                return {"url": url, "text": cached["text"]}
+
+            # 200 以外（キャッシュが消えたあとに届いた 304、そのほかの 1xx/3xx/4xx/5xx）は失敗扱い
+            if res.status_code != 200:
+                print(f"⚠ {url} の取得に失敗: HTTP {res.status_code}")
+                # 404 / 410 はページがないだけ。それ以外は一時的な失敗かもしれない
+                if res.status_code not in PERMANENT_FETCH_ERRORS:
+                    self.degraded = True
+                return None
+
+            # lxml は import が重いので、最初にページをパースするときに読み込む（WARMUP で先読みできる）
+            from html_text import extract_text_from_str
+
+            with self.span("html_parse"):
+                clean_text = extract_text_from_str(html_text)
+            clean_text = clean_text[:PAGE_TEXT_MAX_CHARS]
+
+            # 本文が取れなかったページはキャッシュしない（空のページを新しいものとして返し続けないように）
+            if not clean_text.strip():
+                print(f"⚠ {url} から本文を取り出せませんでした")
+                return None
+
+            if page_cache is not None:
+                page_cache.put(
+                    url,
+                    clean_text,
+                    etag=res.headers.get("ETag"),
+                    last_modified=res.headers.get("Last-Modified"),
+                )
 
-                if res.encoding is None:
-                    res.encoding = res.apparent_encoding
+            return {
+                "url": url,
+                "text": clean_text,
+            }
 
-                html_text = res.text
-                soup = BeautifulSoup(html_text, "html.parser")
-                clean_text = soup.get_text(separator="\n")
-                clean_text = clean_text[:15000]
+        except Exception as e:
+            print(f"⚠ {url} の取得に失敗: {e}")
+            self.degraded = True
+            return None
 
-                pages.append({
-                    "url": url,
-                    "text": clean_text,
-                })
+    def page_get(self, urls):
+        """
+        urls を取得してページのリストを返す。
+        concurrent_fetch が有効なら並列に取得するが、結果の順番は urls の順のまま。
+        取得に失敗したページは結果から除く。
+        """
+        if self.concurrent_fetch and len(urls) > 1:
+            results = list(_fetch_executor.map(self.fetch_page, urls))
+        else:
+            results = [self.fetch_page(url) for url in urls]
 
-            except Exception as e:
-                print(f"⚠ {url} の取得に失敗: {e}")
+        pages = [p for p in results if p is not None]
 
+        # このあと LLM を呼ぶので、不要になったステップならここで止める
+        self.check_cancelled()
         return pages
 
+    # ========== 共通：検索 ==========
+
+    def search_links(self, query, top_n):
+        """
+        検索APIを叩いて、上位 top_n 件のリンクを返す。
+        同じ (query, top_n) は search_cache から返す。
+        """
+        self.check_cancelled()
+
+        cache_key = json.dumps([query, top_n], ensure_ascii=False)
+        links = search_cache.get(cache_key)
+        if links is not None:
+            print("search(cache):", query)
+            return links
+
+        # 同じクエリの検索が実行中なら、その結果を待つ
+        (links, ok), shared = search_flight.do(cache_key, self._search_request, query, top_n, cache_key)
+        if shared:
+            print("search(shared):", query)
+        if not ok:
+            self.degraded = True
+        return links
+
+    def _search_request(self, query, top_n, cache_key):
+        """
+        (links, ok) を返す。ok=False は検索 API がエラーを返したこと（links は空のことが多い）。
+        """
+        with self.span("search"):
+            resp = get_session().get(
+                SEARCH_URL,
+                params={"q": query, "top_n": top_n},
+                timeout=SEARCH_TIMEOUT,
+            )
+            links = resp.json().get("links", [])
+
+        if resp.status_code != 200:
+            print(f"⚠ 検索 API がエラーを返しました: HTTP {resp.status_code}")
+            return links, False
+
+        # 取れたときだけキャッシュする（エラー応答で空を覚えないように）
+        if links:
+            search_cache.set(cache_key, links)
+
+        return links, True
+
     # ========== 直接「店舗代表者」を抜く系 ==========
 
     def parse_direct_rep_from_json(self, json_text):
@@ -125,16 +499,16 @@ class ResearchAI:
         shopaddress = self.shopaddress
 
 
-        resp = requests.get(
-            "https://ecosia1-477268798017.europe-west1.run.app/search",
-            params={"q": f"{shopname} {shopaddress} 代表 オーナー 店主", "top_n": 3}
-        )
-
-        links = resp.json().get("links", [])
+        links = self.search_links(f"{shopname} {shopaddress} 代表 オーナー 店主", 3)
 
         print(links)        # リストそのまま
 
         pages = self.page_get(links)
+        # 対象店舗のページらしくないもの（別店舗・物件情報・ポータルのトップなど）は LLM に渡さない
+        pages = self.filter_shop_pages("direct", pages)
+        if not pages:
+            return False
+        pages = select_relevant(pages, build_anchors("direct", shopname, shopaddress))
 
         prompt = """あなたは日本の店舗情報を解析するアシスタントです。
 
@@ -224,19 +598,40 @@ class ResearchAI:
             "pages": pages
         }
 
-        response_text = self.client.chat(prompt, messages)
+        response_text = self.chat(prompt, messages)
         rep = self.parse_direct_rep_from_json(response_text)
         return rep
 
     # ========== 法人系：共通ヘルパー ==========
 
-    def get_pages_text(self, links):
+    def get_pages_text(self, links, anchors=None, stage=None, company_name=None):
+        """
+        anchors を渡すと、LLM 用のテキストはその周辺だけに絞る。
+        stage を渡すと、対象店舗のページらしいものだけを LLM 用のテキストにする
+        （1ページも残らなければ pages_text は ""）。company_name は法人名での照合用。
+        戻り値の pages は絞り込む前の本文のまま。
+        """
         pages = self.page_get(links)
+        llm_pages = self.filter_shop_pages(stage, pages, company_name) if stage else pages
+        llm_pages = select_relevant(llm_pages, anchors) if anchors else llm_pages
         pages_text = "\n\n".join(
-            [f"[{i+1}] URL: {p['url']}\n{p['text']}" for i, p in enumerate(pages)]
+            [f"[{i+1}] URL: {p['url']}\n{p['text']}" for i, p in enumerate(llm_pages)]
         )
         return pages_text, pages
 
+    def filter_shop_pages(self, stage, pages, company_name=None):
+        """
+        店名（わかっていれば法人名）・住所・電話番号の一致とポータルの減点で、
+        対象店舗のページらしいものだけを残す。
+        """
+        kept = filter_pages(pages, self.shopname, self.shopaddress, company_name=company_name)
+        RELEVANCE_PAGES.inc(len(kept), stage=stage, decision="keep")
+        RELEVANCE_PAGES.inc(len(pages) - len(kept), stage=stage, decision="drop")
+        if pages and not kept:
+            LLM_SKIPPED.inc(stage=stage)
+            print(f"[{stage}] 対象店舗のページがないので LLM は呼びません")
+        return kept
+
     def is_corporate_name(self, name):
         """
         文字列が「法人名っぽいか」をざっくり判定する。
@@ -268,13 +663,12 @@ class ResearchAI:
         shopaddress = self.shopaddress
 
         # ------------ 検索リンク取得（運営会社用）------------
-        resp = requests.get(
-            "https://ecosia1-477268798017.europe-west1.run.app/search",
-            params={"q": f"{shopname} {shopaddress} 運営会社", "top_n": 3}
+        links = self.search_links(f"{shopname} {shopaddress} 運営会社", 3)
+        pages_text, _ = self.get_pages_text(
+            links, build_anchors("company", shopname, shopaddress), stage="company"
         )
-
-        links = resp.json().get("links", [])
-        pages_text, _ = self.get_pages_text(links)
+        if not pages_text:
+            return ""
 
         # ------------ 法人名抽出用プロンプト ------------
         step1_company_prompt = f"""
@@ -452,7 +846,7 @@ class ResearchAI:
 {pages_text}
 """
 
-        response_text = self.client.chat(step1_company_prompt, pages_text)
+        response_text = self.chat(step1_company_prompt, pages_text)
 
         try:
             data = json.loads(response_text)
@@ -471,15 +865,20 @@ class ResearchAI:
         if not company_name or company_name == "False":
             return ""
 
+        # 同じ法人の代表者探しが実行中なら（チェーンの別店舗など）、その結果を待つ
+        key = (_key_digest(self.api_key), corp_name_key(company_name))
+        rep_name, shared = corp_rep_flight.do(key, self._extract_corp_representative, company_name)
+        if shared:
+            print("corp_representative(shared):", company_name)
+        return rep_name
+
+    def _extract_corp_representative(self, company_name):
         # ------------ 検索リンク取得（代表者用）------------
-        resp = requests.get(
-            "https://ecosia1-477268798017.europe-west1.run.app/search",
-            params={"q": f"{company_name} 代表取締役 OR 代表者 OR 代表社員 OR 代表理事 会社概要", "top_n": 5}
+        links = self.search_links(f"{company_name} 代表取締役 OR 代表者 OR 代表社員 OR 代表理事 会社概要", 5)
+        pages_text, _ = self.get_pages_text(
+            links, build_anchors("corp_rep", company_name=company_name)
         )
 
-        links = resp.json().get("links", [])
-        pages_text, _ = self.get_pages_text(links)
-
         # ------------ 代表者抽出用プロンプト ------------
         step2_rep_prompt = f"""
 あなたは日本の法人情報を精密に解析するAIエージェントです。
@@ -534,7 +933,7 @@ class ResearchAI:
 {pages_text}
 """
 
-        rep_response_text = self.client.chat(step2_rep_prompt, pages_text)
+        rep_response_text = self.chat(step2_rep_prompt, pages_text)
 
         try:
             data = json.loads(rep_response_text)
@@ -574,13 +973,20 @@ class ResearchAI:
         query = " ".join(query_parts)
         print("=== インボイス検索クエリ ===", query)
 
-        resp = requests.get(
-            "https://ecosia1-477268798017.europe-west1.run.app/search",
-            params={"q": query, "top_n": 3}
+        links = self.search_links(query, 3)
+        pages_text, pages = self.get_pages_text(
+            links, build_anchors("invoice", shopname, shopaddress, company_name), stage="invoice",
+            company_name=company_name if company_name != shopname else None,
         )
 
-        links = resp.json().get("links", [])
-        pages_text, _ = self.get_pages_text(links)
+        # -------- まずはルールベースで抽出（候補が1つに決まれば LLM は呼ばない）--------
+        invoice = find_invoice_number(pages, [shopname, company_name])
+        if invoice:
+            print("[extract_invoice_number] ルールベースで登録番号を検出:", invoice)
+            return invoice
+
+        if not pages_text:
+            return ""
 
         # -------- LLM プロンプト --------
         invoice_prompt = f"""
@@ -639,7 +1045,7 @@ class ResearchAI:
 {pages_text}
 """
 
-        response_text = self.client.chat(invoice_prompt, "")
+        response_text = self.chat(invoice_prompt, "")
         try:
             data = json.loads(response_text)
             invoice = data.get("result", "").strip()
@@ -665,6 +1071,10 @@ class ResearchAI:
 
         何も取れなかった場合は None を返す。
         """
+        with self.span("nta_lookup"):
+            return self._get_corp_info_from_invoice(invoice_number)
+
+    def _get_corp_info_from_invoice(self, invoice_number):
         if not invoice_number:
             return None
 
@@ -673,11 +1083,25 @@ class ResearchAI:
         if not corporate_number:
             return None
 
-        source_url = f"https://www.houjin-bangou.nta.go.jp/henkorireki-johoto.html?selHouzinNo={corporate_number}"
+        source_url = f"{NTA_URL}?selHouzinNo={corporate_number}"
+
+        # ローカルの法人番号インデックスにあれば、サイトにアクセスしない
+        if corp_index is not None:
+            corp = corp_index.get(corporate_number)
+            if corp:
+                print("[get_corp_info_from_invoice] インデックスから取得した法人名:", corp["name"])
+                return {
+                    "company_name": corp["name"],
+                    "corporate_number": corporate_number,
+                    "representative": None,
+                    "address": corp["address"],
+                    "source_url": source_url,
+                }
 
         try:
-            r = requests.get(source_url, headers={'User-Agent': 'Mozilla/5.0'}, timeout=10)
+            r = get_session().get(source_url, headers={'User-Agent': 'Mozilla/5.0'}, timeout=10)
             r.encoding = "utf-8"
+            from lxml import html
             t = html.fromstring(r.text)
 
             # いままで使っていた XPath をそのまま利用
@@ -710,9 +1134,113 @@ class ResearchAI:
             print("⚠ 法人番号サイトの取得に失敗:", e)
             return None
 
+    # ========== 法人名 → 法人番号（ローカルインデックス） ==========
+
+    def lookup_corporations(self, company_name, prefecture=None):
+        """
+        法人番号インデックスから法人名が一致する法人を探す。
+        インデックスがなければ None（= 確認できない）を返す。
+        """
+        if corp_index is None:
+            return None
+        return corp_index.find_by_name(company_name, prefecture=prefecture)
+
+    def confirm_corporation(self, company_name):
+        """
+        法人名がインデックスの法人1つに決まれば、その法人の dict を返す（決まらなければ None）。
+        同名の法人が複数あるときは、店舗住所の都道府県で絞る。
+        """
+        matches = self.lookup_corporations(company_name)
+        if matches is None:
+            return None
+        if len(matches) > 1:
+            prefecture = parse_address(self.shopaddress).prefecture
+            if prefecture:
+                matches = [m for m in matches if m["prefecture"] == prefecture]
+        print("[STEP4] 法人番号インデックスでの一致:", [m["corporate_number"] for m in matches] or "なし")
+        return matches[0] if len(matches) == 1 else None
+
     # ========== オーケストレーター：優先順位付き ==========
 
-    def run(self):
+    def report_progress(self, stage):
+        self._close_step()
+        self._current_step = (stage, time.perf_counter())
+
+        if self.progress is not None:
+            self.progress(stage)
+
+    def _close_step(self):
+        if self._current_step is not None:
+            step, start = self._current_step
+            with self._spans_lock:
+                self._spans.append((step, time.perf_counter() - start))
+            self._current_step = None
+
+    def _record_metrics(self, result, elapsed):
+        self._close_step()
+        route = result.get("route") if result else "error"
+
+        with self._spans_lock:
+            spans, self._spans = self._spans, []
+        for stage, seconds in spans:
+            STAGE_SECONDS.observe(seconds, stage=stage, route=route)
+        RUN_SECONDS.observe(elapsed, route=route)
+
+    # ---------- 先行並列実行 ----------
+
+    def check_cancelled(self):
+        """
+        先行実行中のステップが打ち切られていたら BranchCancelled を投げる。
+        通常実行（先行実行スレッド外）では何もしない。
+        """
+        event = getattr(self._branch_local, "cancel_event", None)
+        if event is not None and event.is_set():
+            raise BranchCancelled()
+
+    def _run_branch(self, event, fn, args):
+        self._branch_local.cancel_event = event
+        try:
+            return fn(*args)
+        finally:
+            self._branch_local.cancel_event = None
+
+    def _start_branches(self):
+        """
+        互いに依存しない STEP1 / STEP2 / STEP3 の探索を同時に開始する。
+        """
+        branches = {}
+        for name, fn, args in [
+            ("direct", self.serch_name, ()),
+            ("invoice", self.extract_invoice_number, (None,)),
+            ("company", self.extract_company_name, ()),
+        ]:
+            event = threading.Event()
+            future = _branch_executor.submit(self._run_branch, event, fn, args)
+            branches[name] = (future, event)
+        return branches
+
+    def _cancel_branches(self, *names):
+        """
+        先行実行中のステップを打ち切る（names 省略時は残り全部）。
+        """
+        for name in names or list(self._branches):
+            branch = self._branches.pop(name, None)
+            if branch is None:
+                continue
+            future, event = branch
+            event.set()
+            future.cancel()
+
+    def _stage(self, name, fn, *args):
+        """
+        先行実行していればその結果を待ち、していなければ今ここで実行する。
+        """
+        branch = self._branches.pop(name, None)
+        if branch is None:
+            return fn(*args)
+        return branch[0].result()
+
+    def run(self, speculative=None, refresh=False):
         """
         優先順位付きリサーチAI:
 
@@ -724,8 +1252,58 @@ class ResearchAI:
           3. インボイス番号も見つからなかったら
              → 店舗名から運営法人名を LLM で特定
              → 法人名が法人っぽければ、LLMで代表者名を探す
+
+        speculative=True（または RUN_SPECULATIVE=1）のときは 1〜3 の探索を最初に同時に始め、
+        結果は上の優先順位どおりに採用する。上位のルートで決まった時点で、
+        下位のステップは打ち切る。
+
+        同じ店舗を以前に調べていれば、result_store に保存した結果を返す（refresh=True なら調べ直す）。
         """
+        if speculative is None:
+            speculative = self.speculative
+
+        if result_store is not None and not refresh:
+            cached = result_store.get(self.shopname, self.shopaddress)
+            if cached is not None:
+                print(f"run(stored): {self.shopname} → {cached.get('route')}")
+                if self.progress is not None:
+                    self.progress("stored")
+                return cached
+
+        # 同じ店舗のリサーチが実行中なら（二重送信・シートの重複行など）、その結果を待つ
+        result, shared = run_flight.do(self.flight_key(), self._run, speculative)
+        if shared:
+            print(f"run(shared): {self.shopname}")
+            if self.progress is not None:
+                self.progress("shared")
+        # 呼び出し側で書き足しても（sheet_write など）ほかの呼び出しに影響しないようにコピーする
+        return dict(result)
+
+    def flight_key(self):
+        return (_key_digest(self.api_key), shop_key(self.shopname, self.shopaddress))
+
+    def _run(self, speculative):
+        result = None
+        start = time.perf_counter()
+        RUNS_IN_FLIGHT.inc()
+
+        self._branches = self._start_branches() if speculative else {}
+        try:
+            result = self._run_routes()
+        finally:
+            self._cancel_branches()
+            RUNS_IN_FLIGHT.dec()
+            self._record_metrics(result, time.perf_counter() - start)
 
+        if result_store is not None:
+            try:
+                # 検索や取得が一時的に失敗していたら、「見つからなかった」結果は残さない
+                result_store.put(self.shopname, self.shopaddress, result, degraded=self.degraded)
+            except Exception as e:
+                print("⚠ リサーチ結果を保存できません:", e)
+        return result
+
+    def _run_routes(self):
         shopname = self.shopname
         shopaddress = self.shopaddress
 
@@ -736,15 +1314,21 @@ class ResearchAI:
         # STEP1: 店舗の代表者を直接探索
         # ======================
         print("=== STEP1: 店舗の代表者を直接探索 ===")
-        direct_rep = self.serch_name()
+        self.report_progress("STEP1")
+        direct_rep = self._stage("direct", self.serch_name)
 
         if direct_rep:
             print("[STEP1] 店舗代表者を検出:", direct_rep)
+            self._cancel_branches("company")
 
             # ここでインボイスもついでに探しておく（任意）
-            invoice_number = self.extract_invoice_number(
-                direct_rep.get("company")
-            )
+            direct_company = direct_rep.get("company")
+            if direct_company and direct_company != "False" and direct_company != shopname:
+                self._cancel_branches("invoice")
+                invoice_number = self.extract_invoice_number(direct_company)
+            else:
+                # 法人名なしと同じ検索になるので、先行実行していれば結果をそのまま使う
+                invoice_number = self._stage("invoice", self.extract_invoice_number, None)
 
             return {
                 "shopname": shopname,
@@ -763,7 +1347,10 @@ class ResearchAI:
         # STEP2: 店名＋住所 からインボイス番号を探索
         # ======================
         print("=== STEP2: 店名＋住所からインボイス番号を探索 ===")
-        invoice_number = self.extract_invoice_number(
+        self.report_progress("STEP2")
+        invoice_number = self._stage(
+            "invoice",
+            self.extract_invoice_number,
             None   # まだ法人名は使わない
         )
 
@@ -776,6 +1363,7 @@ class ResearchAI:
 
             if corp_info and corp_info.get("company_name"):
                 company_from_invoice = corp_info["company_name"]
+                self._cancel_branches("company")
 
                 # もし法人番号サイトで代表者名まで取れていれば、それをそのまま採用
                 if corp_info.get("representative"):
@@ -792,6 +1380,7 @@ class ResearchAI:
 
                 # 法人名だけわかった場合 → LLMで代表者名を探す
                 print("=== STEP2-追加: 法人名から代表者を LLM で探索 ===")
+                self.report_progress("STEP2-追加")
                 corp_rep = self.extract_corp_representative(company_from_invoice)
                 print("[STEP2-追加] LLMで推定した法人代表者:", corp_rep)
 
@@ -829,7 +1418,8 @@ class ResearchAI:
         # STEP3: 店舗 → 運営法人名を LLM で特定
         # ======================
         print("=== STEP3: 店舗から運営法人名を LLM で探索 ===")
-        company = self.extract_company_name()
+        self.report_progress("STEP3")
+        company = self._stage("company", self.extract_company_name)
         print("[STEP3] LLMから推定された company_name:", company)
 
         if (not company) or (company == "False"):
@@ -866,6 +1456,7 @@ class ResearchAI:
         # STEP4: company_name が法人名っぽいかチェック
         # ======================
         print("=== STEP4: company_name が法人かどうか判定 ===")
+        self.report_progress("STEP4")
         if not self.is_corporate_name(company):
             print("[STEP4] company_name が法人名っぽくない → 個人屋号かも。ここで終了。")
 
@@ -880,10 +1471,18 @@ class ResearchAI:
                 "route": "non_corporate_company_name",
             }
 
+        # インデックスで法人が1つに決まれば、正式な法人名で代表者を探し、法人番号のページを出典にする
+        corp_source_url = None
+        corp = self.confirm_corporation(company)
+        if corp is not None:
+            company = corp["name"]
+            corp_source_url = f"{NTA_URL}?selHouzinNo={corp['corporate_number']}"
+
         # ======================
         # STEP5: 法人の代表者名を LLM で探索
         # ======================
         print("=== STEP5: 法人の代表者を LLM で探索 ===")
+        self.report_progress("STEP5")
         corp_rep = self.extract_corp_representative(company)
         print("[STEP5] 法人代表者(LM推定):", corp_rep)
 
@@ -894,7 +1493,7 @@ class ResearchAI:
                 "company_name": company,
                 "representative": None,
                 "representative_title": None,
-                "source_url": None,
+                "source_url": corp_source_url,
                 "invoice_number": invoice_number,
                 "route": "corp_without_rep",
             }
@@ -905,21 +1504,193 @@ class ResearchAI:
             "company_name": company,
             "representative": corp_rep,
             "representative_title": None,
-            "source_url": None,
+            "source_url": corp_source_url,
             "invoice_number": invoice_number,
             "route": "corp_representative",
         }
 
 
+# ========== 複数店舗の一括リサーチ ==========
+
+BATCH_MAX_WORKERS = int(os.environ.get("BATCH_MAX_WORKERS", 4))
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", 500))
+# /api/batch がリクエストの中で処理する件数の上限。これより多いとジョブにして job_id を返す
+# （1件数十秒かかるので、リクエストのタイムアウト内に終わる件数にしておく）
+BATCH_SYNC_MAX_ITEMS = int(os.environ.get("BATCH_SYNC_MAX_ITEMS", 8))
+
+
+def research_one(shopname, shopaddress, key, refresh=False):
+    """
+    1店舗分の ResearchAI.run。例外は握りつぶして route="error" の結果にする
+    （一括処理で1件の失敗が他に波及しないように）。
+    LLM の呼び出しは一括処理なので、同期 API やジョブより後回しにする。
+    """
+    try:
+        return ResearchAI(shopname, shopaddress, key, priority=PRIORITY_LOW).run(refresh=refresh)
+    except Exception as e:
+        print(f"⚠ {shopname} のリサーチに失敗: {e}")
+        return {
+            "shopname": shopname,
+            "shopaddress": shopaddress,
+            "company_name": None,
+            "representative": None,
+            "representative_title": None,
+            "source_url": None,
+            "invoice_number": "",
+            "route": "error",
+            "error": str(e),
+        }
+
+
+def research_batch(items, key, workers=BATCH_MAX_WORKERS, refresh=False, progress=None):
+    """
+    items: [{"shopname": ..., "shopaddress": ...}, ...]
+    結果は items と同じ順番で返す。
+    progress: 1件終わるごとに progress(done=..., total=...) で呼ぶ（ジョブの進捗用）
+    """
+    workers = max(1, min(workers, BATCH_MAX_WORKERS, len(items) or 1))
+    done = [0]
+    done_lock = threading.Lock()
+
+    def one(item):
+        result = research_one(item["shopname"], item["shopaddress"], key, refresh)
+        if progress is not None:
+            with done_lock:
+                done[0] += 1
+                progress(done=done[0], total=len(items))
+        return result
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch") as ex:
+        futures = [ex.submit(one, item) for item in items]
+        return [f.result() for f in futures]
+
+
+def research_batch_job(items, key, workers=BATCH_MAX_WORKERS, refresh=False, job=None):
+    return {"results": research_batch(items, key, workers, refresh=refresh, progress=job.report)}
+
+
 # ========== 動作テスト ==========
 
 app = Flask(__name__)
+job_manager = JobManager()
+
+
+@app.before_request
+def _metrics_before_request():
+    g.metrics_start = time.perf_counter()
+    g.metrics_endpoint = request.endpoint or "unknown"
+    HTTP_IN_FLIGHT.inc(endpoint=g.metrics_endpoint)
+
+
+@app.after_request
+def _metrics_after_request(response):
+    HTTP_REQUESTS.inc(endpoint=g.get("metrics_endpoint", "unknown"), status=response.status_code)
+    return response
+
+
+@app.teardown_request
+def _metrics_teardown_request(exc):
+    endpoint = g.get("metrics_endpoint")
+    if endpoint is None:
+        return
+    HTTP_IN_FLIGHT.dec(endpoint=endpoint)
+    HTTP_SECONDS.observe(time.perf_counter() - g.metrics_start, endpoint=endpoint)
+
+
+def _cache_metrics():
+    """
+    各キャッシュのヒット・ミス数を /metrics 用に集める。
+    """
+    def flatten(name, stats):
+        if stats is None:
+            return []
+        if stats.get("backend") == "tiered":
+            return flatten(name + "_memory", stats["memory"]) + flatten(name + "_sqlite", stats["sqlite"])
+        return [(name, stats)]
+
+    caches = []
+    caches += flatten("page", page_cache.stats() if page_cache is not None else None)
+    caches += flatten("search", search_cache.stats())
+    caches += flatten("llm", llm_cache.stats() if llm_cache is not None else None)
+    caches += flatten("result", result_store.stats() if result_store is not None else None)
+
+    hits = [({"cache": n}, st["hits"]) for n, st in caches]
+    misses = [({"cache": n}, st["misses"]) for n, st in caches]
+    entries = [({"cache": n}, st["entries"]) for n, st in caches]
+    return [
+        ("cache_hits_total", "counter", "キャッシュのヒット数", hits),
+        ("cache_misses_total", "counter", "キャッシュのミス数", misses),
+        ("cache_entries", "gauge", "キャッシュの件数", entries),
+    ]
+
+
+REGISTRY.add_collector(_cache_metrics)
+REGISTRY.add_collector(lambda: [
+    ("singleflight_shared_total", "counter", "実行中の同じ処理の結果を待って受け取った回数",
+     [({"flight": f.name}, f.shared) for f in (run_flight, search_flight, corp_rep_flight)]),
+])
+def _llm_router_metrics():
+    models = llm_router.stats()
+    return [
+        ("llm_model_wins_total", "counter", "モデルの返答が採用された回数",
+         [({"model": m["model"]}, m["wins"]) for m in models]),
+        ("llm_model_hedges_total", "counter", "応答が遅くヘッジとして送った回数",
+         [({"model": m["model"]}, m["hedges"]) for m in models]),
+        ("llm_model_errors_total", "counter", "モデルの呼び出しが失敗した回数",
+         [({"model": m["model"]}, m["errors"]) for m in models]),
+    ]
+
+
+REGISTRY.add_collector(_llm_router_metrics)
+
+
+def _llm_scheduler_metrics():
+    keys = llm_scheduler.stats()["keys"]
+    return [
+        ("llm_scheduler_queued", "gauge", "LLM の待ち行列で待っている呼び出し数",
+         [({"key": k["key"]}, k["queued"]) for k in keys]),
+        ("llm_scheduler_active", "gauge", "キーごとの実行中の LLM 呼び出し数",
+         [({"key": k["key"]}, k["active"]) for k in keys]),
+        ("llm_scheduler_throttled_total", "counter", "429 を受けてキーを止めた回数",
+         [({"key": k["key"]}, k["throttled"]) for k in keys]),
+    ]
+
+
+REGISTRY.add_collector(_llm_scheduler_metrics)
+REGISTRY.add_collector(lambda: [
+    ("jobs", "gauge", "状態ごとのジョブ数",
+     [({"status": status}, n) for status, n in job_manager.counts().items()]),
+])
 
 @app.route("/")
 def home():
     return jsonify({"message": "ResearchAI API Running"})
 
 
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(REGISTRY.render(), mimetype=None, content_type=METRICS_CONTENT_TYPE)
+
+
+@app.route("/api/cache/stats")
+def cache_stats():
+    return jsonify({
+        "page_cache": page_cache.stats() if page_cache is not None else None,
+        "search_cache": search_cache.stats(),
+        "llm_cache": llm_cache.stats() if llm_cache is not None else None,
+        "result_store": result_store.stats() if result_store is not None else None,
+        "sheet_clients": sheet_clients.stats(),
+        "sheet_writers": writer_stats(),
+        "singleflight": {f.name: f.stats() for f in (run_flight, search_flight, corp_rep_flight)},
+    })
+
+
+@app.route("/api/llm/stats")
+def llm_stats():
+    # モデルごとの応答時間・採用率（LLM_MODELS の並びを決める材料）
+    return jsonify({"models": LLM_MODELS, "stats": llm_router.stats(), "scheduler": llm_scheduler.stats()})
+
+
 @app.route("/api/run", methods=["POST"])
 def run_api():
     data = request.get_json(silent=True)
@@ -934,8 +1705,10 @@ def run_api():
         return jsonify({"error": "shopname と shopaddress は必須です"}), 400
 
     # ==== ResearchAI 実行 ====
-    ai = ResearchAI(shopname, shopaddress,key)
-    result = ai.run()
+    # "refresh": true なら保存済みの結果を使わずに調べ直す
+    # 呼び出し元が結果を待っているので、LLM の待ち行列では一括処理やジョブより先に回す
+    ai = ResearchAI(shopname, shopaddress,key, priority=PRIORITY_HIGH)
+    result = ai.run(refresh=data.get("refresh") in (True, "1", "true"))
 
     # ==== ログとして出力（Cloud Run のログに残る） ====
     print("\n=== リサーチ結果 ===")
@@ -949,62 +1722,59 @@ def run_api():
     print("ソースURL   :", result.get("source_url"))
 
     return jsonify(result)
-@app.route("/api/add", methods=["POST"])
-def run_add():
-    shopname = request.form.get("shopname")
-    shopaddress = request.form.get("shopaddress")
-    key = request.form.get("key")
-    row = request.form.get("row")
-    sheet_name = request.form.get("sheet")
-    file = request.files.get("file")
 
-    if not shopname or not shopaddress or not key:
-        return jsonify({"error": "shopname / shopaddress / key は必須です"}), 400
-    if not row:
-        return jsonify({"error": "row が指定されていません"}), 400
-    if not sheet_name:
-        return jsonify({"error": "sheet が指定されていません"}), 400
-    if not file:
-        return jsonify({"error": "file が添付されていません"}), 400
 
-    # === 一時ファイルへ保存 ===
-    import tempfile
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".json") as tmp:
-        file.save(tmp.name)
-        SERVICE_ACCOUNT_FILE = tmp.name
+@app.route("/api/batch", methods=["POST"])
+def run_batch_api():
+    """
+    {"key": ..., "items": [{"shopname": ..., "shopaddress": ...}, ...], "workers": 4, "refresh": false}
+    items が BATCH_SYNC_MAX_ITEMS 件を超えるときはジョブとして受け付け、job_id を返す
+    （結果は GET /api/jobs/<job_id> の result.results）。
+    """
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"error": "JSONが必要です"}), 400
 
-    import gspread
-    from google.oauth2 import service_account
+    key = data.get("key")
+    items = data.get("items")
 
-    SPREADSHEET_ID = "1CI69F1PDS2ROYLP4Q4dO37ba1MBvW72yqxx9jPy9UL4"
-    scopes = ["https://www.googleapis.com/auth/spreadsheets"]
-    creds = service_account.Credentials.from_service_account_file(
-        SERVICE_ACCOUNT_FILE, scopes=scopes
-    )
-    gc = gspread.authorize(creds)
-    ws = gc.open_by_key(SPREADSHEET_ID).worksheet(sheet_name)
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "items（店舗のリスト）は必須です"}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"items は最大 {BATCH_MAX_ITEMS} 件までです"}), 400
 
-    # ================================
-    # ① AI検索前に赤色へ変更（開始マーク）
-    # ================================
-    ws.format(f"A{row}:H{row}", {
-        "backgroundColor": {"red": 1, "green": 0.8, "blue": 0.8}
-    })
+    for i, item in enumerate(items):
+        if not isinstance(item, dict) or not item.get("shopname") or not item.get("shopaddress"):
+            return jsonify({"error": f"items[{i}] に shopname と shopaddress は必須です"}), 400
 
-    # ================================
-    # ② ResearchAI 実行（ここ重い）
-    # ================================
-    ai = ResearchAI(shopname, shopaddress, key)
-    result = ai.run()
+    try:
+        workers = int(data.get("workers", BATCH_MAX_WORKERS))
+    except (TypeError, ValueError):
+        return jsonify({"error": "workers は整数で指定してください"}), 400
 
-    # === 出力デバッグ ===
-    print("\n=== リサーチ結果 ===")
-    for k, v in result.items():
-        print(k, ":", v)
+    refresh = data.get("refresh") in (True, "1", "true")
+    if len(items) > BATCH_SYNC_MAX_ITEMS:
+        job = job_manager.submit("batch", research_batch_job, items, key, workers, refresh)
+        return jsonify({"job_id": job.id, "status": job.status}), 202
 
-    # ================================
-    # ③ safe() で値整形
-    # ================================
+    results = research_batch(items, key, workers, refresh=refresh)
+
+    print(f"\n=== 一括リサーチ完了: {len(results)} 件 ===")
+    for r in results:
+        print(r.get("shopname"), ":", r.get("route"))
+
+    return jsonify({"results": results})
+
+
+# ========== スプレッドシート書き込み ==========
+
+SPREADSHEET_ID = "1CI69F1PDS2ROYLP4Q4dO37ba1MBvW72yqxx9jPy9UL4"
+
+
+def result_to_row_values(result):
+    """
+    ResearchAI の結果を C:H に書く6つの値にする。
+    """
     def safe(v):
         if v is None:
             return "不明"
@@ -1015,7 +1785,7 @@ def run_add():
             return s
         return str(v)
 
-    values = [
+    return [
         safe(result.get("company_name")),
         safe(result.get("representative")),
         safe(result.get("representative_title")),
@@ -1024,17 +1794,53 @@ def run_add():
         safe(result.get("source_url")),
     ]
 
+
+def write_research_to_sheet(credentials_json, sheet_name, row, shopname, shopaddress, key, refresh=False, job=None):
+    """
+    credentials_json: サービスアカウントの JSON（bytes）
+    """
+    # 同じ認証情報・同じシートなら、認証済みのワークシートを使い回す
+    ws = sheet_clients.worksheet(credentials_json, SPREADSHEET_ID, sheet_name)
+
+    # ================================
+    # ① AI検索前に赤色へ変更（開始マーク）
+    #    同じシートのほかの行の書き込みとまとめて送る
+    # ================================
+    writer = get_writer(ws)
+    writer.mark_started(row)
+
+    # ================================
+    # ② ResearchAI 実行（ここ重い）
+    # ================================
+    progress = job.report if job is not None else None
+    ai = ResearchAI(shopname, shopaddress, key, progress=progress)
+    try:
+        result = ai.run(refresh=refresh)
+    except Exception:
+        # 開始マーク（赤）のまま残さない
+        writer.mark_failed(row)
+        raise
+
+    # === 出力デバッグ ===
+    print("\n=== リサーチ結果 ===")
+    for k, v in result.items():
+        print(k, ":", v)
+
     # ================================
-    # ④ 値書き込み
+    # ③ safe() で値整形
     # ================================
-    ws.update(f"C{row}:H{row}", [values])
+    values = result_to_row_values(result)
 
     # ================================
-    # ⑤ 白へ戻す（完了マーク）
+    # ④ 値書き込み + 白へ戻す（完了マーク）
+    #    batchUpdate 1回にまとめ、送信されるまで待つ
     # ================================
-    ws.format(f"A{row}:H{row}", {
-        "backgroundColor": {"red": 1, "green": 1, "blue": 1}
-    })
+    try:
+        writer.write_row(row, values)
+    except Exception:
+        # シート名の変更や権限の取り消しに備えて、次回は開き直す
+        sheet_clients.forget(credentials_json, SPREADSHEET_ID, sheet_name)
+        raise
 
     result["sheet_write"] = {
         "status": "success",
@@ -1042,9 +1848,163 @@ def run_add():
         "range": f"C{row}:H{row}"
     }
 
+    return result
+
+
+@app.route("/api/add", methods=["POST"])
+def run_add():
+    shopname = request.form.get("shopname")
+    shopaddress = request.form.get("shopaddress")
+    key = request.form.get("key")
+    row = request.form.get("row")
+    sheet_name = request.form.get("sheet")
+    file = request.files.get("file")
+
+    if not shopname or not shopaddress or not key:
+        return jsonify({"error": "shopname / shopaddress / key は必須です"}), 400
+    if not row:
+        return jsonify({"error": "row が指定されていません"}), 400
+    if not row.isdigit() or int(row) < 1:
+        return jsonify({"error": "row は 1 以上の整数で指定してください"}), 400
+    if not sheet_name:
+        return jsonify({"error": "sheet が指定されていません"}), 400
+    if not file:
+        return jsonify({"error": "file が添付されていません"}), 400
+
+    # 一時ファイルには書かず、メモリ上の JSON から認証する
+    credentials_json = file.read()
+    try:
+        json.loads(credentials_json)
+    except ValueError:
+        return jsonify({"error": "file はサービスアカウントの JSON を指定してください"}), 400
+
+    refresh = request.form.get("refresh") in ("1", "true")
+    args = (credentials_json, sheet_name, int(row), shopname, shopaddress, key, refresh)
+
+    # async=1 ならジョブとして受け付けて、すぐに job_id を返す
+    if request.form.get("async") in ("1", "true"):
+        job = job_manager.submit("add", write_research_to_sheet, *args)
+        return jsonify({"job_id": job.id, "status": job.status}), 202
+
+    result = write_research_to_sheet(*args)
     return jsonify(result)
 
 
+def sync_sheet_job(credentials_json, sheet_name, key, first_row=2, limit=None, workers=SHEET_SYNC_MAX_WORKERS, job=None):
+    ws = sheet_clients.worksheet(credentials_json, SPREADSHEET_ID, sheet_name)
+
+    def research_row(shopname, shopaddress):
+        result = research_one(shopname, shopaddress, key)
+        if result.get("route") == "error":
+            raise RuntimeError(result.get("error"))
+        return result_to_row_values(result)
+
+    with SyncCheckpoint() as checkpoint:
+        return sync_sheet(
+            ws,
+            research_row,
+            checkpoint,
+            first_row=first_row,
+            limit=limit,
+            max_workers=workers,
+            progress=job.report if job is not None else None,
+        )
+
+
+@app.route("/api/sheet/sync", methods=["POST"])
+def run_sheet_sync():
+    """
+    シートの C:H が空の行をまとめて処理するジョブを起動する。
+    /api/add を1行ずつ呼ぶ代わりに、シートごとに1回呼べばよい。
+
+    form: sheet, key, file（サービスアカウントの JSON）, first_row（既定 2）, limit, workers
+    途中で止まっても、同じ内容でもう一度呼べば続きから処理する。
+    """
+    sheet_name = request.form.get("sheet")
+    key = request.form.get("key")
+    file = request.files.get("file")
+
+    if not sheet_name or not key:
+        return jsonify({"error": "sheet / key は必須です"}), 400
+    if not file:
+        return jsonify({"error": "file が添付されていません"}), 400
+
+    try:
+        first_row = int(request.form.get("first_row") or 2)
+        limit = int(request.form["limit"]) if request.form.get("limit") else None
+        workers = int(request.form.get("workers") or SHEET_SYNC_MAX_WORKERS)
+    except ValueError:
+        return jsonify({"error": "first_row / limit / workers は整数で指定してください"}), 400
+    if first_row < 1:
+        return jsonify({"error": "first_row は 1 以上で指定してください"}), 400
+    workers = max(1, min(workers, SHEET_SYNC_MAX_WORKERS))
+
+    credentials_json = file.read()
+    try:
+        json.loads(credentials_json)
+    except ValueError:
+        return jsonify({"error": "file はサービスアカウントの JSON を指定してください"}), 400
+
+    try:
+        ws = sheet_clients.worksheet(credentials_json, SPREADSHEET_ID, sheet_name)
+    except Exception as e:
+        return jsonify({"error": f"シートを開けません: {e}"}), 400
+    if is_sync_running(ws):
+        return jsonify({"error": f"{sheet_name} は一括処理中です"}), 409
+
+    job = job_manager.submit(
+        "sheet_sync", sync_sheet_job, credentials_json, sheet_name, key,
+        first_row=first_row, limit=limit, workers=workers,
+    )
+    return jsonify({"job_id": job.id, "status": job.status}), 202
+
+
+# ========== 非同期ジョブAPI ==========
+
+def research_job(shopname, shopaddress, key, refresh=False, job=None):
+    return ResearchAI(shopname, shopaddress, key, progress=job.report).run(refresh=refresh)
+
+
+@app.route("/api/jobs", methods=["POST"])
+def submit_job():
+    """
+    /api/run と同じ JSON を受け取り、ジョブIDだけをすぐに返す。
+    結果は GET /api/jobs/<job_id> で取得する。
+    """
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"error": "JSONが必要です"}), 400
+
+    shopname = data.get("shopname")
+    shopaddress = data.get("shopaddress")
+    key = data.get("key")
+
+    if not shopname or not shopaddress:
+        return jsonify({"error": "shopname と shopaddress は必須です"}), 400
+
+    refresh = data.get("refresh") in (True, "1", "true")
+    job = job_manager.submit("run", research_job, shopname, shopaddress, key, refresh)
+    return jsonify({"job_id": job.id, "status": job.status}), 202
+
+
+@app.route("/api/jobs/<job_id>")
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "ジョブが見つかりません"}), 404
+    return jsonify(job.to_dict())
+
+
+# ========== 起動 ==========
+
+STARTUP_SECONDS.set(time.perf_counter() - _IMPORT_STARTED, phase="import")
+
+# WARMUP=sync / background のとき、最初のリクエストより前に重いモジュールと接続を用意する
+start_warmup(
+    hooks=[get_session],
+    on_done=lambda seconds, timings: STARTUP_SECONDS.set(seconds, phase="warmup"),
+)
+
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8080))
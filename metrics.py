@@ -0,0 +1,174 @@
+"""
+Prometheus のテキスト形式で出すための、最小限のメトリクス実装（Counter / Gauge / Histogram）。
+
+/metrics からは REGISTRY.render() の結果を返す。
+キャッシュの統計のように、値を別の場所で持っているものは add_collector() で出力に足す。
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: ラベルは {self.labelnames} を指定してください")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _header(self):
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            item = self._values.get(key)
+            if item is None:
+                # [バケットごとの件数..., 合計, 件数]
+                item = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    item[i] += 1
+            item[-2] += value
+            item[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            for key, item in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, item):
+                    labels = _format_labels(self.labelnames, key, ("le", bound))
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.labelnames, key, ("le", "+Inf"))
+                lines.append(f"{self.name}_bucket{labels} {item[-1]}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {item[-2]}")
+                lines.append(f"{self.name}_count{labels} {item[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def add_collector(self, fn):
+        """
+        fn() は [(name, type, help, [(labels_dict, value), ...]), ...] を返す関数。
+        """
+        with self._lock:
+            self._collectors.append(fn)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+
+        for fn in collectors:
+            try:
+                families = fn()
+            except Exception as e:
+                print("⚠ メトリクスの収集に失敗:", e)
+                continue
+            for name, type_name, documentation, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {type_name}")
+                for labels, value in samples:
+                    names = tuple(labels)
+                    values = tuple(labels[n] for n in names)
+                    lines.append(f"{name}{_format_labels(names, values)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
@@ -0,0 +1,305 @@
+"""
+店名・住所の正規化（キャッシュのキーや照合に使う）。
+
+"東京都新宿区西新宿１－２－３ ○○ビル2F" と "新宿区西新宿1丁目2番3号" が同じキーになるように、
+
+- 全角半角をそろえる（NFKC）、ハイフン類を "-" にそろえる
+- 丁目・番地・番・号の前の漢数字を算用数字にする（"三丁目" → "3丁目"）
+- "1丁目2番3号" / "1-2-3" / "1番地の2" を (1, 2, 3) のような番地にする
+- 番地のあとのビル名・階数（"○○ビル2F"、"B1階" など）はキーに含めない
+- 都道府県はキーに含めない（書いてあってもなくても同じキーになる）
+- 店名の支店表記（"新宿店"、"本店"、"(渋谷店)" など）はキーに含めない
+
+住所は Address（prefecture / city / town / block / building）に分けて返すので、
+部分ごとの照合（compare_addresses）にも使える。
+正規表現はすべて事前にコンパイルし、結果は lru_cache に載せるので、
+リクエストごとや法人番号インデックスの全行に対して呼んでも重くない。
+"""
+import re
+import unicodedata
+from functools import lru_cache
+from typing import NamedTuple, Optional, Tuple
+
+# NFKC のあとに残るハイフン類（長音 "ー" は数字の間にあるときだけ別に置き換える）
+_DASHES = "‐‑‒–—―−－﹣"
+_DASH_TABLE = str.maketrans({c: "-" for c in _DASHES})
+_CHOON_RE = re.compile(r"(?<=\d)[ーｰ](?=\d)")
+_SPACE_RE = re.compile(r"\s+")
+
+_KANJI_DIGITS = {"〇": 0, "零": 0, "一": 1, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_KANJI_UNITS = {"十": 10, "百": 100, "千": 1000}
+# 丁目・番地・番・号・条・地割の前の漢数字だけを数字にする（"三軒茶屋" や "二番町" は地名のまま）
+_KANJI_NUMBER_RE = re.compile(r"([〇零一二三四五六七八九十百千]+)(?=丁目|番地|番(?!町)|号|条|地割)")
+
+_POSTAL_RE = re.compile(r"^〒?\s*\d{3}-?\d{4}\s*")
+_PREF_RE = re.compile(r"^(東京都|北海道|(?:京都|大阪)府|.{2,3}?県)")
+_COUNTY_RE = re.compile(r"^.+?郡")
+# 市区町村は「市・区」で終わるものと「町・村」で終わるものを別々に探す（_split_city を参照）
+_CITY_SHI_RE = re.compile(r"^.+?[市区]")
+_CITY_CHO_RE = re.compile(r"^.+?[町村]")
+_WARD_RE = re.compile(r"^.+?区")
+# 市区町村名の中に「町」「村」が含まれているとみなす、町村のあとから市・区までの文字数
+# （"東村山市" "武蔵村山市" "十日町市" など）
+_CITY_INNER_CHARS = 2
+_AZA_RE = re.compile(r"^(?:大字|字)")
+# 町名（番地の数字の手前まで）。"北1条西"（札幌）や "5線"（北海道）、"3地割"（岩手）の数字は町名に含める
+_TOWN_RE = re.compile(r"(?:\d+(?:条|線|地割)|\D)*")
+# 番地の数字1つ分と、そのあとの区切り（"1丁目" "2番地の" "3号" "4-" など）
+_BLOCK_PART_RE = re.compile(r"(\d+)(?:丁目|番地の?|番|号|の|-)?")
+# 番地のあとに付くことのある区切り
+_BUILDING_LEAD_RE = re.compile(r"^[\s,、・-]+")
+
+_BRACKET_BRANCH_RE = re.compile(r"[(（\[【「]([^)）\]】」]*店)[)）\]】」]")
+# 区切りなしで付いていても支店表記とみなすもの（"○○支店" は地名との境目がわからないので含めない）
+_BRANCH_SUFFIX_RE = re.compile(r"(本店|\d+号店)$")
+
+# 法人格の表記（法人名のキーでは外す）
+CORP_FORMS = [
+    "株式会社",
+    "有限会社",
+    "合同会社",
+    "合資会社",
+    "合名会社",
+    "一般社団法人",
+    "一般財団法人",
+    "公益社団法人",
+    "公益財団法人",
+    "特定非営利活動法人",
+    "NPO法人",
+    "医療法人社団",
+    "医療法人財団",
+    "医療法人",
+    "社会福祉法人",
+    "学校法人",
+    "(株)",
+    "(有)",
+    "(同)",
+]
+
+
+class Address(NamedTuple):
+    prefecture: Optional[str]
+    city: Optional[str]
+    town: str
+    block: Tuple[int, ...]
+    building: str
+
+    def key(self):
+        """
+        都道府県とビル名・階数を除いた比較用のキー（"新宿区|西新宿|1-2-3"）。
+        """
+        return f"{self.city or ''}|{self.town}|{'-'.join(map(str, self.block))}"
+
+
+def fold(text):
+    """
+    全角半角・ハイフン類をそろえ、空白を1つにまとめる（大文字小文字もそろえる）。
+    """
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKC", text).translate(_DASH_TABLE)
+    text = _CHOON_RE.sub("-", text)
+    return _SPACE_RE.sub(" ", text).strip().lower()
+
+
+def kanji_to_int(text):
+    """
+    "二十三" → 23、"百五" → 105、"一〇" → 10 のように漢数字を数値にする。
+    """
+    total = 0
+    current = 0
+    digits_only = all(c in _KANJI_DIGITS for c in text)
+    if digits_only:
+        # "一〇" のような位取りなしの書き方
+        for c in text:
+            current = current * 10 + _KANJI_DIGITS[c]
+        return current
+
+    for c in text:
+        if c in _KANJI_DIGITS:
+            current = _KANJI_DIGITS[c]
+        else:
+            total += (current or 1) * _KANJI_UNITS[c]
+            current = 0
+    return total + current
+
+
+def replace_kanji_numbers(text):
+    return _KANJI_NUMBER_RE.sub(lambda m: str(kanji_to_int(m.group(1))), text)
+
+
+def _split_city(text):
+    """
+    都道府県のあとの文字列を (市区町村, 残り) に分ける。市区町村が取れなければ (None, text)。
+    "東村山市本町" の "村" や "町田市" の "町" で切らないよう、市・区で終わる候補を優先し、
+    町・村で終わる候補はそれより十分手前で終わるとき（"軽井沢町大字市村" など）だけ使う。
+    郡のあとはその逆で、町・村で終わる候補を優先する。
+    """
+    # 郡はそのまま市区町村名の前に付ける（"大和郡山市" のように市の名前に "郡" があっても同じ結果になる）
+    county = ""
+    m = _COUNTY_RE.match(text)
+    if m:
+        county = m.group(0)
+    body = text[len(county):]
+
+    shi = _CITY_SHI_RE.match(body)
+    cho = _CITY_CHO_RE.match(body)
+    if county:
+        # 郡の中は町村なので、町・村で終わる候補を優先する（"上市町"）。
+        # 市がずっと手前で終わるなら、"郡" は市の名前の一部（"大和郡山市"）
+        if shi and (not cho or cho.end() - shi.end() > _CITY_INNER_CHARS):
+            m = shi
+        else:
+            m = cho
+    elif cho and (not shi or shi.end() - cho.end() > _CITY_INNER_CHARS):
+        m = cho
+    else:
+        m = shi
+    if not m or m.group(0)[0].isdigit():
+        return None, text
+
+    city = county + m.group(0)
+    rest = body[m.end():]
+    if city.endswith("市"):
+        # "四日市市" "廿日市市" のように、市の名前自体に "市" が含まれる場合
+        if rest[:1] == "市":
+            city += "市"
+            rest = rest[1:]
+        # 政令指定都市の区
+        m = _WARD_RE.match(rest)
+        if m:
+            city += m.group(0)
+            rest = rest[m.end():]
+    return city, rest
+
+
+@lru_cache(maxsize=65536)
+def parse_address(address):
+    """
+    住所を Address に分ける。
+    "東京都新宿区西新宿一丁目2番3号 ○○ビル2F"
+      → Address("東京都", "新宿区", "西新宿", (1, 2, 3), "○○ビル2f")
+    """
+    text = fold(address)
+    text = _POSTAL_RE.sub("", text)
+    text = replace_kanji_numbers(text)
+
+    prefecture = None
+    m = _PREF_RE.match(text)
+    if m:
+        prefecture = m.group(1)
+        text = text[m.end():]
+    text = text.lstrip()
+
+    city, text = _split_city(text)
+    text = text.replace(" ", "")
+
+    # 町名と番地に分ける
+    i = _TOWN_RE.match(text).end()
+    town = _AZA_RE.sub("", text[:i])
+    rest = text[i:]
+
+    block = []
+    pos = 0
+    while len(block) < 3:
+        m = _BLOCK_PART_RE.match(rest, pos)
+        if not m:
+            break
+        block.append(int(m.group(1)))
+        pos = m.end()
+        # 区切りのない数字（"3 ○○ビル" など）で番地は終わり
+        if m.group(0) == m.group(1):
+            break
+
+    building = _BUILDING_LEAD_RE.sub("", rest[pos:])
+    return Address(prefecture, city, town, tuple(block), building)
+
+
+def address_key(address):
+    """
+    住所の比較用キー。町名も番地も取れない住所は、そろえた文字列そのものを使う。
+    """
+    if not address:
+        return ""
+    parsed = parse_address(address)
+    if not parsed.town and not parsed.block:
+        return fold(address).replace(" ", "")
+    return parsed.key()
+
+
+def compare_addresses(a, b):
+    """
+    2つの住所（文字列または Address）の一致度を 0〜1 で返す。
+    都道府県・市区町村・町名・番地のうち、両方にある部分がどれだけ一致しているか。
+    番地は短い方が長い方の先頭と一致すれば一致とみなす（"1-2" と "1-2-3"）。
+    """
+    if isinstance(a, str):
+        a = parse_address(a)
+    if isinstance(b, str):
+        b = parse_address(b)
+
+    checked = 0
+    matched = 0
+    for x, y in ((a.prefecture, b.prefecture), (a.city, b.city), (a.town, b.town)):
+        if x and y:
+            checked += 1
+            matched += x == y or x.endswith(y) or y.endswith(x)
+    if a.block and b.block:
+        checked += 1
+        n = min(len(a.block), len(b.block))
+        matched += a.block[:n] == b.block[:n]
+    return matched / checked if checked else 0.0
+
+
+@lru_cache(maxsize=65536)
+def split_shop_name(name):
+    """
+    店名を (本体, 支店表記) に分ける。
+    "ラーメン太郎 新宿店" → ("ラーメン太郎", "新宿店")
+    "ラーメン太郎（渋谷店）" → ("ラーメン太郎", "渋谷店")
+    "ラーメン太郎本店" → ("ラーメン太郎", "本店")
+    "山田商店" → ("山田商店", "")  ※ 区切りのない "○○店" は店名の一部として残す
+    """
+    text = fold(name)
+    branch = ""
+
+    m = _BRACKET_BRANCH_RE.search(text)
+    if m:
+        branch = m.group(1).strip()
+        text = (text[:m.start()] + text[m.end():]).strip()
+    else:
+        parts = text.rsplit(" ", 1)
+        if len(parts) == 2 and parts[1].endswith("店") and len(parts[1]) >= 2:
+            text, branch = parts
+        else:
+            m = _BRANCH_SUFFIX_RE.search(text)
+            if m and m.start() > 0:
+                branch = m.group(1)
+                text = text[:m.start()]
+
+    return text.replace(" ", "").strip("・-"), branch
+
+
+def shop_name_key(name):
+    base, _ = split_shop_name(name)
+    return base
+
+
+def corp_name_key(name):
+    """
+    法人名の比較用キー。全角半角と空白をそろえ、法人格（株式会社など）を取り除く。
+    """
+    if not name:
+        return ""
+    key = unicodedata.normalize("NFKC", name)
+    key = "".join(key.split())
+    for form in CORP_FORMS:
+        key = key.replace(form, "")
+    return key.lower()
+
+
+def shop_key(shopname, shopaddress):
+    """
+    店舗（店名＋住所）のキー。結果ストアや同時実行のまとめに使う。
+    """
+    return f"{shop_name_key(shopname)}\n{address_key(shopaddress)}"
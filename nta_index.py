@@ -0,0 +1,304 @@
+"""
+国税庁 法人番号公表サイトの一括ダウンロードファイル（全件・差分）から作る、ローカルの法人番号インデックス。
+
+- 法人番号 → 法人名・所在地 を SQLite から引く（法人番号サイトへのアクセスが不要になる）
+- 正規化した法人名 → 法人番号 も引ける（extract_company_name の結果をネットワークなしで確認できる）
+- 差分ファイルは取り込み済みのものを記録して、未適用の分だけ順番に当てる
+
+使い方:
+  python nta_index.py import 00_zenkoku_all_20240101.zip
+  python nta_index.py import diff_20240102.zip diff_20240103.zip
+  python nta_index.py lookup 1180301018771
+  python nta_index.py name トヨタ自動車株式会社
+"""
+import argparse
+import csv
+import io
+import os
+import sqlite3
+import sys
+import threading
+import zipfile
+
+from normalize import corp_name_key
+
+NTA_INDEX_DB = os.environ.get("NTA_INDEX_DB", "nta_index.sqlite3")
+
+# CSV の列位置（法人番号システム Web-API / 一括ダウンロード共通のレイアウト）
+COL_SEQUENCE = 0
+COL_CORPORATE_NUMBER = 1
+COL_PROCESS = 2
+COL_UPDATE_DATE = 4
+COL_NAME = 6
+COL_KIND = 8
+COL_PREFECTURE = 9
+COL_CITY = 10
+COL_STREET = 11
+COL_POST_CODE = 15
+COL_CLOSE_DATE = 18
+COL_LATEST = 23
+COL_FURIGANA = 28
+
+# 処理区分 99 = 削除
+PROCESS_DELETE = "99"
+
+BATCH_SIZE = 5000
+
+
+def normalize_corp_name(name):
+    """
+    名前照合用のキー（normalize.corp_name_key と同じ）。
+    """
+    return corp_name_key(name)
+
+
+class CorporateIndex:
+    def __init__(self, path=NTA_INDEX_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS corporations (
+                corporate_number TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                name_key TEXT NOT NULL,
+                furigana TEXT,
+                kind TEXT,
+                prefecture TEXT,
+                city TEXT,
+                street TEXT,
+                post_code TEXT,
+                close_date TEXT,
+                update_date TEXT
+            );
+            CREATE INDEX IF NOT EXISTS corporations_name_key ON corporations (name_key);
+            CREATE TABLE IF NOT EXISTS applied_files (
+                file_name TEXT PRIMARY KEY,
+                rows INTEGER,
+                applied_at TEXT DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        self._conn.commit()
+
+    # ========== 取り込み ==========
+
+    def _iter_rows(self, path):
+        """
+        zip（中の .csv）または .csv を1行ずつ返す。文字コードは UTF-8 / Shift_JIS を自動判定。
+        """
+        if zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as zf:
+                for info in zf.infolist():
+                    if not info.filename.lower().endswith(".csv"):
+                        continue
+                    with zf.open(info) as f:
+                        yield from self._iter_csv(f)
+        else:
+            with open(path, "rb") as f:
+                yield from self._iter_csv(f)
+
+    def _iter_csv(self, binary):
+        head = binary.read(4096)
+        encoding = "utf-8-sig"
+        try:
+            head.decode("utf-8")
+        except UnicodeDecodeError as e:
+            # 4096 バイト目で多バイト文字が切れただけなら UTF-8 のまま
+            if e.start < len(head) - 3:
+                encoding = "cp932"
+
+        stream = io.TextIOWrapper(
+            io.BufferedReader(_Prepend(head, binary)), encoding=encoding, newline=""
+        )
+        yield from csv.reader(stream)
+
+    def import_file(self, path, force=False):
+        """
+        全件ファイル・差分ファイルを取り込む。同じファイル名は2回取り込まない（force=True で再適用）。
+        取り込んだ行数を返す（スキップした場合は 0）。
+        """
+        file_name = os.path.basename(path)
+        with self._lock:
+            done = self._conn.execute(
+                "SELECT 1 FROM applied_files WHERE file_name = ?", (file_name,)
+            ).fetchone()
+        if done and not force:
+            print(f"[nta_index] {file_name} は取り込み済みなのでスキップ")
+            return 0
+
+        upserts = []
+        count = 0
+
+        def flush():
+            if not upserts:
+                return
+            with self._lock:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO corporations VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+                    upserts,
+                )
+            upserts.clear()
+
+        for row in self._iter_rows(path):
+            if len(row) <= COL_LATEST or not row[COL_CORPORATE_NUMBER].isdigit():
+                continue
+
+            number = row[COL_CORPORATE_NUMBER]
+            if row[COL_PROCESS] == PROCESS_DELETE:
+                # 差分は通し番号順なので、前に積んだ更新を先に反映してから消す
+                flush()
+                with self._lock:
+                    self._conn.execute(
+                        "DELETE FROM corporations WHERE corporate_number = ?", (number,)
+                    )
+            elif row[COL_LATEST] == "1":
+                name = row[COL_NAME]
+                upserts.append((
+                    number,
+                    name,
+                    normalize_corp_name(name),
+                    row[COL_FURIGANA] if len(row) > COL_FURIGANA else None,
+                    row[COL_KIND],
+                    row[COL_PREFECTURE],
+                    row[COL_CITY],
+                    row[COL_STREET],
+                    row[COL_POST_CODE],
+                    row[COL_CLOSE_DATE] or None,
+                    row[COL_UPDATE_DATE],
+                ))
+            else:
+                continue
+
+            count += 1
+            if len(upserts) >= BATCH_SIZE:
+                flush()
+
+        flush()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO applied_files (file_name, rows) VALUES (?, ?)",
+                (file_name, count),
+            )
+            self._conn.commit()
+
+        print(f"[nta_index] {file_name}: {count} 行を取り込みました")
+        return count
+
+    # ========== 検索 ==========
+
+    _COLUMNS = (
+        "corporate_number", "name", "furigana", "kind", "prefecture",
+        "city", "street", "post_code", "close_date", "update_date",
+    )
+
+    def _to_dict(self, row):
+        item = dict(zip(self._COLUMNS, row))
+        item["address"] = "".join(x for x in (item["prefecture"], item["city"], item["street"]) if x)
+        return item
+
+    def get(self, corporate_number):
+        """
+        法人番号（13桁）→ 法人情報 dict。なければ None。
+        """
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(self._COLUMNS)} FROM corporations WHERE corporate_number = ?",
+                (corporate_number,),
+            ).fetchone()
+        return self._to_dict(row) if row else None
+
+    def find_by_name(self, name, prefecture=None, limit=20):
+        """
+        法人名 → 法人情報 dict のリスト（閉鎖済みの法人は除く）。
+        prefecture を渡すとその都道府県の法人に絞る。
+        """
+        key = normalize_corp_name(name)
+        if not key:
+            return []
+
+        sql = f"SELECT {', '.join(self._COLUMNS)} FROM corporations WHERE name_key = ? AND close_date IS NULL"
+        params = [key]
+        if prefecture:
+            sql += " AND prefecture = ?"
+            params.append(prefecture)
+        sql += " LIMIT ?"
+        params.append(limit)
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [self._to_dict(r) for r in rows]
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM corporations").fetchone()[0]
+
+
+class _Prepend(io.RawIOBase):
+    """
+    先頭を読んでしまったバイナリストリームに、読んだ分を戻して読み直せるようにする。
+    """
+
+    def __init__(self, head, rest):
+        self._head = head
+        self._rest = rest
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self._head:
+            n = min(len(b), len(self._head))
+            b[:n] = self._head[:n]
+            self._head = self._head[n:]
+            return n
+        data = self._rest.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+
+def open_default_index():
+    """
+    NTA_INDEX_DB があればインデックスを開く。まだ作っていなければ None。
+    """
+    if not NTA_INDEX_DB or not os.path.exists(NTA_INDEX_DB):
+        return None
+    try:
+        return CorporateIndex(NTA_INDEX_DB)
+    except sqlite3.Error as e:
+        print("⚠ 法人番号インデックスを開けません:", e)
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="法人番号インデックスの作成・検索")
+    parser.add_argument("--db", default=NTA_INDEX_DB)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_import = sub.add_parser("import", help="全件/差分ファイルを取り込む（指定順に適用）")
+    p_import.add_argument("files", nargs="+")
+    p_import.add_argument("--force", action="store_true", help="取り込み済みのファイルも再適用する")
+
+    p_lookup = sub.add_parser("lookup", help="法人番号で検索")
+    p_lookup.add_argument("number")
+
+    p_name = sub.add_parser("name", help="法人名で検索")
+    p_name.add_argument("name")
+    p_name.add_argument("--prefecture")
+
+    args = parser.parse_args(argv)
+    index = CorporateIndex(args.db)
+
+    if args.command == "import":
+        for path in args.files:
+            index.import_file(path, force=args.force)
+        print(f"[nta_index] 登録件数: {index.count()}")
+    elif args.command == "lookup":
+        print(index.get(args.number.lstrip("T")))
+    elif args.command == "name":
+        for item in index.find_by_name(args.name, prefecture=args.prefecture):
+            print(item)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+"""
+page_get 用のディスクキャッシュ。
+
+URL の sha256 をファイル名にして、抽出済みテキストと ETag / Last-Modified を保存する。
+- TTL 内ならネットワークに出ずにそのまま返す
+- TTL 切れでも ETag / Last-Modified があれば条件付きGETで再検証し、
+  304 ならダウンロードも BeautifulSoup のパースもしない
+- 合計サイズが max_bytes を超えたら、最後に使われたのが古い順に消す（LRU）
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+PAGE_CACHE_DIR = os.environ.get("PAGE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "page_cache"))
+PAGE_CACHE_TTL = int(os.environ.get("PAGE_CACHE_TTL", 7 * 24 * 3600))
+PAGE_CACHE_MAX_BYTES = int(os.environ.get("PAGE_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+
+
+class PageCache:
+    def __init__(self, directory, ttl=PAGE_CACHE_TTL, max_bytes=PAGE_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        # key -> ファイルサイズ。先頭ほど最近使われていない
+        self._index = OrderedDict()
+        self._total_bytes = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    # ========== 内部ヘルパー ==========
+
+    def _key(self, url):
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def _load_index(self):
+        """
+        起動時にディスク上のエントリを mtime（最終利用時刻）順に読み込む。
+        """
+        entries = []
+        for sub in os.listdir(self.directory):
+            subdir = os.path.join(self.directory, sub)
+            if not os.path.isdir(subdir):
+                continue
+            for name in os.listdir(subdir):
+                if not name.endswith(".json"):
+                    continue
+                st = os.stat(os.path.join(subdir, name))
+                entries.append((st.st_mtime, name[:-5], st.st_size))
+
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._total_bytes += size
+
+    def _evict(self):
+        # self._lock を持った状態で呼ぶこと
+        while self._total_bytes > self.max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def _write(self, key, entry):
+        path = self._path(key)
+        data = json.dumps(entry, ensure_ascii=False).encode("utf-8")
+
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            # キャッシュに書けなくても本処理は止めない
+            print("⚠ ページキャッシュへの書き込みに失敗:", e)
+            return
+
+        with self._lock:
+            self._total_bytes -= self._index.pop(key, 0)
+            self._index[key] = len(data)
+            self._total_bytes += len(data)
+            self._evict()
+
+    # ========== 公開API ==========
+
+    def lookup(self, url):
+        """
+        (entry, fresh) を返す。
+          - entry: キャッシュ内容 dict（なければ None）
+          - fresh: TTL 内ならTrue（そのまま使ってよい）
+        """
+        key = self._key(url)
+        path = self._path(key)
+
+        try:
+            with open(path, "rb") as f:
+                entry = json.loads(f.read())
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None, False
+
+        with self._lock:
+            if key in self._index:
+                self._index.move_to_end(key)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        fresh = time.time() - entry.get("fetched_at", 0) < self.ttl
+        with self._lock:
+            if fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return entry, fresh
+
+    def conditional_headers(self, entry):
+        """
+        再検証用の If-None-Match / If-Modified-Since ヘッダーを返す。
+        """
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def mark_revalidated(self, url, entry):
+        """
+        304 が返ってきたエントリの取得時刻を更新する。
+        （revalidated は misses の内数）
+        """
+        entry = dict(entry, fetched_at=time.time())
+        self._write(self._key(url), entry)
+        with self._lock:
+            self.revalidated += 1
+
+    def put(self, url, text, etag=None, last_modified=None):
+        entry = {
+            "url": url,
+            "text": text,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fetched_at": time.time(),
+        }
+        self._write(self._key(url), entry)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidated": self.revalidated,
+                "evictions": self.evictions,
+                "entries": len(self._index),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+def create_default_page_cache():
+    """
+    PAGE_CACHE_DIR が空ならキャッシュ無効（None）。
+    """
+    if not PAGE_CACHE_DIR:
+        return None
+    try:
+        return PageCache(PAGE_CACHE_DIR)
+    except OSError as e:
+        print("⚠ ページキャッシュを初期化できません:", e)
+        return None
@@ -0,0 +1,408 @@
+"""
+LLM に渡すページ本文の絞り込み。
+
+ページ先頭から一律に切るのではなく、ステージごとの手がかり語（店名・住所の一部・
+代表/店主/運営会社/登録番号 など）の周辺だけを残す。
+複数ページに共通して出てくる行（ヘッダー・フッター・メニューなど）は落とす。
+全体の文字数はステージごとの予算内に収める。
+
+その前段として score_page / filter_pages で、対象の店舗についてのページかどうかを
+LLM を使わずに点数付けし、明らかに別の店・物件情報・ポータルのトップなどのページを落とす。
+"""
+import os
+import re
+import unicodedata
+from urllib.parse import urlparse
+
+from normalize import CORP_FORMS, fold, parse_address, replace_kanji_numbers, split_shop_name
+
+# 1ステージで LLM に渡す本文の合計文字数
+STAGE_TEXT_BUDGET = int(os.environ.get("STAGE_TEXT_BUDGET", 12000))
+# 手がかり語が見つかった行の前後何行を残すか
+WINDOW_LINES = int(os.environ.get("RELEVANCE_WINDOW_LINES", 4))
+# 手がかり語が1つもないページは先頭のこの文字数だけ残す（一致判定の材料として）
+HEAD_CHARS = 1000
+
+STAGE_KEYWORDS = {
+    # serch_name: 店舗のトップを直接探す
+    "direct": ["代表", "店主", "オーナー", "マスター", "経営者", "運営会社", "会社概要"],
+    # extract_company_name: 運営法人を探す
+    "company": ["運営会社", "運営", "会社概要", "会社名", "事業者", "株式会社", "合同会社", "有限会社"],
+    # extract_corp_representative: 法人の代表者を探す
+    "corp_rep": ["代表取締役", "代表者", "代表社員", "代表理事", "代表", "会社概要", "役員"],
+    # extract_invoice_number: 登録番号を探す
+    "invoice": ["登録番号", "インボイス", "適格請求書", "事業者", "会社概要"],
+}
+
+SEPARATOR = "\n…\n"
+
+# ページの点数がこれ未満なら LLM に渡さない（RELEVANCE_FILTER=0 で点数付け自体をしない）
+RELEVANCE_FILTER = os.environ.get("RELEVANCE_FILTER", "1") == "1"
+RELEVANCE_MIN_SCORE = float(os.environ.get("RELEVANCE_MIN_SCORE", 0.35))
+
+# 点数の内訳の重み
+NAME_WEIGHT = 0.45
+ADDRESS_WEIGHT = 0.45
+PHONE_BONUS = 0.2
+# 店名・住所がよく一致したページ（ここで見つかった電話番号を、ほかのページの照合に使う）
+STRONG_SCORE = 0.7
+
+# 店舗の公式ページではないことが多いサイトの減点。トップページ（パスなし）は一律で落とす
+PORTAL_PENALTIES = {
+    # 不動産（テナント募集・物件情報）
+    "suumo.jp": 0.4,
+    "homes.co.jp": 0.4,
+    "athome.co.jp": 0.4,
+    "chintai.net": 0.4,
+    "realestate.yahoo.co.jp": 0.4,
+    "tenpo.biz": 0.4,
+    # 求人
+    "indeed.com": 0.3,
+    "townwork.net": 0.3,
+    "baitoru.com": 0.3,
+    "mynavi.jp": 0.3,
+    # グルメ・地図ポータル（店舗の詳細ページは手がかりになるので軽め）
+    "tabelog.com": 0.1,
+    "hotpepper.jp": 0.1,
+    "gnavi.co.jp": 0.1,
+    "retty.me": 0.1,
+    "ekiten.jp": 0.1,
+    "mapion.co.jp": 0.1,
+    "navitime.co.jp": 0.1,
+}
+
+
+def _norm(text):
+    return "".join(unicodedata.normalize("NFKC", text).split())
+
+
+_WARD_CITY_RE = re.compile(r"^(.+市)(.+区)$")
+
+
+def address_anchors(address):
+    """
+    住所から照合用の断片を取り出す（"東京都新宿区西新宿1-2-3" → ["東京都", "新宿区", "西新宿", "1-2-3"]）。
+    分け方は normalize.parse_address と同じ。政令市の区・郡のある町村は、区・町村だけの形も加える。
+    """
+    if not address:
+        return []
+    parsed = parse_address(address)
+    anchors = [parsed.prefecture]
+    if parsed.city:
+        anchors.append(parsed.city)
+        if "郡" in parsed.city:
+            anchors.append(parsed.city.split("郡", 1)[1])
+        m = _WARD_CITY_RE.match(parsed.city)
+        if m:
+            anchors += m.groups()
+    anchors.append(parsed.town)
+    if parsed.block:
+        anchors.append("-".join(map(str, parsed.block)))
+    return [a for a in anchors if a and len(a) >= 2]
+
+
+def name_anchors(name):
+    """
+    店名・法人名の照合用の形（全体と、支店名などを除いた先頭部分）。
+    """
+    if not name or name == "False":
+        return []
+    anchors = [_norm(name)]
+    head = unicodedata.normalize("NFKC", name).split()
+    if len(head) > 1 and len(head[0]) >= 2:
+        anchors.append(head[0])
+    return anchors
+
+
+def build_anchors(stage, shopname=None, shopaddress=None, company_name=None):
+    anchors = list(STAGE_KEYWORDS.get(stage, []))
+    anchors += name_anchors(shopname)
+    anchors += name_anchors(company_name)
+    anchors += address_anchors(shopaddress)
+    # 重複を除く（順序は保つ）
+    return list(dict.fromkeys(a for a in anchors if a))
+
+
+def find_boilerplate(pages):
+    """
+    2ページ以上に同じ形で出てくる行の集合（正規化済み）。
+    """
+    if len(pages) < 2:
+        return set()
+
+    seen = {}
+    for p in pages:
+        for line in {_norm(l) for l in (p.get("text") or "").splitlines()}:
+            if line:
+                seen[line] = seen.get(line, 0) + 1
+    return {line for line, n in seen.items() if n >= 2}
+
+
+def window_text(text, anchors, budget, boilerplate=frozenset()):
+    """
+    1ページ分の本文から、手がかり語の周辺の行だけを budget 文字以内で返す。
+    """
+    lines = []
+    norm_lines = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        norm = _norm(line)
+        hit = any(a in norm for a in anchors)
+        # 共通行は落とす（ただし手がかり語を含むなら残す）
+        if norm in boilerplate and not hit:
+            continue
+        if lines and norm == norm_lines[-1]:
+            continue
+        lines.append(line)
+        norm_lines.append(norm)
+
+    hits = [i for i, norm in enumerate(norm_lines) if any(a in norm for a in anchors)]
+    if not hits:
+        return "\n".join(lines)[:min(budget, HEAD_CHARS)]
+
+    # 手がかり行の前後をまとめて区間にする
+    spans = []
+    for i in hits:
+        start, end = max(0, i - WINDOW_LINES), min(len(lines), i + WINDOW_LINES + 1)
+        if spans and start <= spans[-1][1]:
+            spans[-1][1] = max(spans[-1][1], end)
+            spans[-1][2] += 1
+        else:
+            spans.append([start, end, 1])
+
+    # 手がかり語を多く含む区間から予算の範囲で採用し、本文の順番に並べ直す
+    chosen = []
+    remaining = budget
+    for start, end, _ in sorted(spans, key=lambda s: (-s[2], s[0])):
+        if remaining <= 0:
+            break
+        chunk = "\n".join(lines[start:end])[:remaining]
+        chosen.append((start, chunk))
+        remaining -= len(chunk) + len(SEPARATOR)
+
+    return SEPARATOR.join(chunk for _, chunk in sorted(chosen))
+
+
+def select_relevant(pages, anchors, budget=STAGE_TEXT_BUDGET):
+    """
+    pages（page_get の戻り値）の text を、手がかり語の周辺だけに絞った新しいリストを返す。
+    予算はページ数で等分する。
+    """
+    if not pages:
+        return pages
+
+    boilerplate = find_boilerplate(pages)
+    per_page = max(budget // len(pages), 1)
+    return [
+        dict(p, text=window_text(p.get("text") or "", anchors, per_page, boilerplate))
+        for p in pages
+    ]
+
+
+# ========== LLM に渡す前のページの点数付け ==========
+
+_PHONE_RE = re.compile(r"(?<!\d)\(?0\d{1,4}\)?-?\d{1,4}-\d{3,4}(?!\d)")
+_BLOCK_SEP = r"(?:丁目|番地の?|番|号|の|-)?"
+
+
+def _compact(text):
+    """
+    照合用に、全角半角・ハイフン・漢数字をそろえて空白を除く。
+    """
+    return replace_kanji_numbers(fold(text)).replace(" ", "")
+
+
+def _bigrams(text):
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+_CORP_FORMS_COMPACT = sorted({_compact(f) for f in CORP_FORMS}, key=len, reverse=True)
+
+
+def _company_core(company_name):
+    """
+    法人名から法人格を除いた照合用の形（ページの本文と同じく _compact でそろえる）。
+    """
+    if not company_name or company_name == "False":
+        return ""
+    core = _compact(company_name)
+    for form in _CORP_FORMS_COMPACT:
+        core = core.replace(form, "")
+    return core if len(core) >= 2 else ""
+
+
+class ShopProfile:
+    """
+    照合に使う対象店舗の情報（店名の本体・支店表記・住所の各部分、わかっていれば運営法人名）。
+    店名もページの本文と同じく _compact でそろえる（"ラーメン一番" → "ラーメン1番"）。
+    """
+
+    def __init__(self, shopname, shopaddress, company_name=None):
+        base, branch = split_shop_name(shopname or "")
+        base = _compact(base)
+        branch = _compact(branch)
+        self.name = base
+        self.full_name = (base + branch) if branch else base
+        self.branch = branch
+        self.name_bigrams = _bigrams(base)
+        self.company = _company_core(company_name)
+        self.address = parse_address(shopaddress or "")
+
+        block = self.address.block
+        self.block_re = re.compile(r"(?<!\d)" + _BLOCK_SEP.join(map(str, block)) + r"(?!\d)") if block else None
+        self.block_prefix_re = (
+            re.compile(r"(?<!\d)" + _BLOCK_SEP.join(map(str, block[:2])) + r"(?!\d)") if len(block) >= 3 else None
+        )
+
+
+def _name_score(profile, text):
+    # 運営法人名がわかっているステージでは、法人名の一致も店名の一致と同じに扱う
+    # （法人のサイトや登録番号の一覧には店名が出てこないことが多い）
+    if profile.company and profile.company in text:
+        return 1.0
+    if not profile.name:
+        return 0.0
+    if profile.full_name in text:
+        return 1.0
+    if profile.name in text:
+        # 支店表記のある店で、本体の名前しか出てこない（同じチェーンの別店舗かもしれない）
+        return 0.7 if profile.branch else 1.0
+    if len(profile.name_bigrams) < 2:
+        return 0.0
+    # 表記ゆれ（"・" の有無や一部の言い換え）を、2文字ずつの重なりで見る
+    hit = sum(1 for bg in profile.name_bigrams if bg in text)
+    coverage = hit / len(profile.name_bigrams)
+    return coverage * 0.6 if coverage >= 0.6 else 0.0
+
+
+def _address_score(profile, text):
+    address = profile.address
+    parts = []
+    if address.city:
+        parts.append((0.25, address.city in text))
+    if address.town:
+        parts.append((0.35, address.town in text))
+    if profile.block_re is not None:
+        if profile.block_re.search(text):
+            parts.append((0.4, 1.0))
+        elif profile.block_prefix_re is not None and profile.block_prefix_re.search(text):
+            parts.append((0.4, 0.5))
+        else:
+            parts.append((0.4, 0.0))
+    if not parts:
+        return 0.0
+    total = sum(w for w, _ in parts)
+    return sum(w * float(v) for w, v in parts) / total
+
+
+def _portal_penalty(url):
+    """
+    (減点, トップページか) を返す。
+    """
+    parsed = urlparse(url or "")
+    host = (parsed.hostname or "").lower()
+    for domain, penalty in PORTAL_PENALTIES.items():
+        if host == domain or host.endswith("." + domain):
+            return penalty, parsed.path in ("", "/")
+    return 0.0, False
+
+
+def find_phones(text):
+    """
+    本文中の電話番号（数字だけにしたもの）の集合。
+    """
+    return {re.sub(r"\D", "", m) for m in _PHONE_RE.findall(text)}
+
+
+def score_page(page, profile):
+    """
+    1ページが対象店舗についてのページらしいかを 0〜1 程度の点数にする。
+    {"url", "score", "name", "address", "penalty", "phones"} を返す（phones は電話番号の照合用）。
+    """
+    text = _compact(page.get("text") or "")
+    name = _name_score(profile, text)
+    address = _address_score(profile, text)
+    penalty, is_top = _portal_penalty(page.get("url"))
+
+    score = NAME_WEIGHT * name + ADDRESS_WEIGHT * address - penalty
+    if is_top:
+        score = 0.0
+    return {
+        "url": page.get("url"),
+        "score": score,
+        "name": name,
+        "address": address,
+        "penalty": penalty,
+        "phones": find_phones(text),
+    }
+
+
+def filter_pages(pages, shopname, shopaddress, min_score=None, company_name=None):
+    """
+    pages のうち、対象店舗についてのページらしいものだけを元の順番で返す。
+    company_name を渡すと、その法人名が出てくるページも店名が一致したページとして扱う。
+
+    1. 店名・住所の一致とポータルの減点で点数を付ける
+    2. 店名・住所がよく一致したページにある電話番号が載っているページは加点する
+    3. min_score（既定 RELEVANCE_MIN_SCORE）未満のページを落とす
+    """
+    if not RELEVANCE_FILTER or not pages:
+        return pages
+    if min_score is None:
+        min_score = RELEVANCE_MIN_SCORE
+
+    profile = ShopProfile(shopname, shopaddress, company_name)
+    scores = [score_page(p, profile) for p in pages]
+
+    known_phones = set()
+    for s in scores:
+        if s["score"] >= STRONG_SCORE:
+            known_phones |= s["phones"]
+    for s in scores:
+        if s["score"] < STRONG_SCORE and s["phones"] & known_phones:
+            s["score"] += PHONE_BONUS
+
+    kept = []
+    for page, s in zip(pages, scores):
+        keep = s["score"] >= min_score
+        print(
+            f"[relevance] {'keep' if keep else 'drop'} {s['score']:.2f} "
+            f"(name={s['name']:.2f} address={s['address']:.2f} penalty={s['penalty']:.2f}) {s['url']}"
+        )
+        if keep:
+            kept.append(page)
+    return kept
+
+
+# 店名・法人名の照合で落としてはいけないページ（python relevance.py で確認する。外れたら終了コード 1）
+REGRESSION_CASES = [
+    # (店名, 住所, 法人名, ページ本文)
+    ("ラーメン一番", "", None, "ラーメン一番\n会社概要"),
+    ("一番星", "", None, "一番星\n会社概要"),
+    ("三条珈琲", "", None, "三条珈琲\n会社概要"),
+    ("焼鳥 二番", "", None, "焼鳥二番\n会社概要"),
+    ("すし処 十番", "", None, "すし処 十番\n会社概要"),
+    ("ラーメン一番", "東京都東村山市本町一丁目2番3号", None, "ラーメン1番 東村山市本町1-2-3"),
+    # 法人名で探すステージでは、店名の出てこない法人のページも残す
+    ("麺屋たろう", "", "株式会社サンプルフーズ", "(株)サンプルフーズ 会社概要\n登録番号 T1234567890123"),
+]
+
+
+def _check_regressions():
+    failed = 0
+    for shopname, shopaddress, company_name, text in REGRESSION_CASES:
+        page = {"url": "https://example.jp/about", "text": text}
+        kept = filter_pages([page], shopname, shopaddress, min_score=RELEVANCE_MIN_SCORE, company_name=company_name)
+        if not kept:
+            failed += 1
+            print(f"NG: {shopname} / {company_name} のページが落とされました")
+    print(f"{len(REGRESSION_CASES) - failed}/{len(REGRESSION_CASES)} OK")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    import sys
+
+    sys.exit(_check_regressions())
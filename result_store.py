@@ -0,0 +1,113 @@
+"""
+ResearchAI.run の結果を店舗ごとに保存しておくストア。
+
+同じ店舗（店名＋住所）をもう一度調べるときは、パイプラインを動かさずに保存済みの結果を返す。
+キーは normalize.shop_key（表記ゆれ・ビル名・支店表記をならしたもの）。
+保存期間は route ごとに変える:
+
+- 代表者まで取れた結果（shop_direct / invoice_official など）は長く
+- 法人名だけの結果は中くらい
+- 見つからなかった結果（no_info / shopname_only）は短く（あとで情報が出てくることがあるので）
+- route="error" は保存しない
+- 検索や取得が一時的に失敗した run の「見つからなかった」結果も保存しない（put の degraded）
+
+保存先は cache.py のバックエンド（RESULT_STORE_BACKEND=sqlite / memory / none）。
+get / set / delete / stats を持つものなら差し替えられる。
+"""
+import os
+import tempfile
+import time
+
+from cache import create_cache
+from normalize import shop_key
+
+# sqlite（既定。メモリを前段に置く）/ memory / none
+RESULT_STORE_BACKEND = os.environ.get("RESULT_STORE_BACKEND", "sqlite")
+RESULT_STORE_DB = os.environ.get(
+    "RESULT_STORE_DB", os.path.join(tempfile.gettempdir(), "research_results.sqlite3")
+)
+# メモリ側に置く件数
+RESULT_STORE_SIZE = int(os.environ.get("RESULT_STORE_SIZE", 4096))
+
+DAY = 24 * 3600
+# 代表者まで取れた結果
+RESULT_TTL_FOUND = int(os.environ.get("RESULT_TTL_FOUND", 30 * DAY))
+# 法人名までは取れたが代表者がわからない結果
+RESULT_TTL_PARTIAL = int(os.environ.get("RESULT_TTL_PARTIAL", 7 * DAY))
+# 何も見つからなかった結果（ネガティブキャッシュ）
+RESULT_TTL_NOT_FOUND = int(os.environ.get("RESULT_TTL_NOT_FOUND", 1 * DAY))
+
+# 何も見つからなかった route
+NOT_FOUND_ROUTES = {"no_info", "shopname_only"}
+
+ROUTE_TTLS = {
+    "shop_direct": RESULT_TTL_FOUND,
+    "invoice_official": RESULT_TTL_FOUND,
+    "invoice_corp_representative": RESULT_TTL_FOUND,
+    "corp_representative": RESULT_TTL_FOUND,
+    "invoice_corp_only": RESULT_TTL_PARTIAL,
+    "corp_without_rep": RESULT_TTL_PARTIAL,
+    "non_corporate_company_name": RESULT_TTL_PARTIAL,
+    "no_info": RESULT_TTL_NOT_FOUND,
+    "shopname_only": RESULT_TTL_NOT_FOUND,
+    "error": 0,
+}
+
+
+class ResultStore:
+    def __init__(self, backend, route_ttls=None):
+        self.backend = backend
+        self.route_ttls = dict(ROUTE_TTLS, **(route_ttls or {}))
+        self.stored = 0
+        self.skipped = 0
+
+    def ttl_for(self, route):
+        # 知らない route は「何も見つからなかった」と同じ扱いにする
+        return self.route_ttls.get(route, RESULT_TTL_NOT_FOUND)
+
+    def get(self, shopname, shopaddress):
+        """
+        保存済みの結果を返す（なければ None）。cached_at に保存した時刻が入る。
+        """
+        entry = self.backend.get(shop_key(shopname, shopaddress))
+        if entry is None:
+            return None
+        return dict(entry["result"], cached_at=entry["stored_at"])
+
+    def put(self, shopname, shopaddress, result, degraded=False):
+        """
+        degraded=True（検索 API のエラーやページ取得の失敗があった）なら、
+        見つからなかった結果は障害のせいかもしれないので保存しない。
+        """
+        route = result.get("route")
+        if degraded and route in NOT_FOUND_ROUTES:
+            self.skipped += 1
+            return False
+        ttl = self.ttl_for(route)
+        if ttl <= 0:
+            return False
+        self.backend.set(
+            shop_key(shopname, shopaddress),
+            {"result": result, "stored_at": time.time()},
+            ttl=ttl,
+        )
+        self.stored += 1
+        return True
+
+    def delete(self, shopname, shopaddress):
+        self.backend.delete(shop_key(shopname, shopaddress))
+
+    def stats(self):
+        return dict(self.backend.stats(), stored=self.stored, skipped_degraded=self.skipped)
+
+
+def create_result_store(backend=None):
+    backend = backend or RESULT_STORE_BACKEND
+    if backend == "none":
+        return None
+    # TTL は put() で route ごとに決めるので、ここでの ttl は使われない
+    if backend == "sqlite":
+        return ResultStore(create_cache(
+            RESULT_STORE_SIZE, RESULT_TTL_FOUND, sqlite_path=RESULT_STORE_DB, table="research_results"
+        ))
+    return ResultStore(create_cache(RESULT_STORE_SIZE, RESULT_TTL_FOUND))
@@ -0,0 +1,604 @@
+"""
+Google スプレッドシートへの書き込み。
+
+/api/add は1行ごとに「赤にする → 値を書く → 白に戻す」の3回 API を呼んでいた。
+ここでは値の書き込みと背景色の変更を spreadsheets.batchUpdate の1リクエストにまとめ、
+さらに SheetWriter が複数行分を溜めてから1回で送る。
+
+- mark_started(row): 開始マーク（赤）を予約する
+- write_row(row, values): C:H の値と完了マーク（白）を予約し、送信されるまで待つ
+- mark_failed(row): リサーチに失敗した行に失敗マーク（黄）を予約する（赤のまま残さない）
+- 溜まった行数が SHEET_WRITE_BATCH_ROWS に達するか、
+  最初の予約から SHEET_WRITE_FLUSH_SECONDS 秒たったらまとめて送る
+
+認証済みクライアントと開いたワークシートは SheetClientCache に保持し、
+同じ認証情報・同じシートへの2回目以降の書き込みでは認証とメタデータ取得を省く。
+
+sync_sheet() はシート全体を batch_get 1回で読み、C:H が空の行だけをまとめて処理する。
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# この行数の書き込みが溜まったらすぐ送る
+SHEET_WRITE_BATCH_ROWS = int(os.environ.get("SHEET_WRITE_BATCH_ROWS", 20))
+# 溜まりきらなくても、この秒数たったら送る
+SHEET_WRITE_FLUSH_SECONDS = float(os.environ.get("SHEET_WRITE_FLUSH_SECONDS", 2))
+
+# 結果を書く列（C:H）と、色を付ける列（A:H）。0 始まり、end は含まない
+VALUE_START_COLUMN = 2
+ROW_END_COLUMN = 8
+
+# 認証済みクライアントを何組まで保持するか（認証情報の種類数）
+SHEETS_CLIENT_CACHE_SIZE = int(os.environ.get("SHEETS_CLIENT_CACHE_SIZE", 16))
+# この秒数使われなかったクライアントは捨てる
+SHEETS_CLIENT_TTL = int(os.environ.get("SHEETS_CLIENT_TTL", 3600))
+
+# 一括処理で同時に ResearchAI を走らせる数
+SHEET_SYNC_MAX_WORKERS = int(os.environ.get("SHEET_SYNC_MAX_WORKERS", 4))
+# この回数失敗した行は、次回以降の一括処理で飛ばす
+SHEET_SYNC_MAX_ATTEMPTS = int(os.environ.get("SHEET_SYNC_MAX_ATTEMPTS", 3))
+# 一括処理の進捗（チェックポイント）を保存する SQLite
+SHEET_SYNC_DB = os.environ.get("SHEET_SYNC_DB", "sheet_sync.sqlite3")
+
+SHEETS_SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+
+COLOR_STARTED = {"red": 1, "green": 0.8, "blue": 0.8}
+COLOR_DONE = {"red": 1, "green": 1, "blue": 1}
+COLOR_FAILED = {"red": 1, "green": 0.95, "blue": 0.6}
+
+
+def format_row_request(sheet_id, row, color):
+    """
+    row 行目（1 始まり）の A:H の背景色を変える repeatCell リクエスト。
+    """
+    return {
+        "repeatCell": {
+            "range": {
+                "sheetId": sheet_id,
+                "startRowIndex": row - 1,
+                "endRowIndex": row,
+                "startColumnIndex": 0,
+                "endColumnIndex": ROW_END_COLUMN,
+            },
+            "cell": {"userEnteredFormat": {"backgroundColor": color}},
+            "fields": "userEnteredFormat.backgroundColor",
+        }
+    }
+
+
+def update_row_request(sheet_id, row, values, start_column=VALUE_START_COLUMN):
+    """
+    row 行目（1 始まり）の start_column 列から values を文字列として書く updateCells リクエスト。
+    ws.update() の既定（RAW）と同じく、数式や日付として解釈させない。
+    """
+    return {
+        "updateCells": {
+            "start": {"sheetId": sheet_id, "rowIndex": row - 1, "columnIndex": start_column},
+            "rows": [{"values": [{"userEnteredValue": {"stringValue": str(v)}} for v in values]}],
+            "fields": "userEnteredValue",
+        }
+    }
+
+
+class _Pending:
+    def __init__(self, row, requests):
+        self.row = row
+        self.requests = requests
+        self.done = threading.Event()
+        self.error = None
+
+
+class SheetWriter:
+    """
+    1つのワークシートへの書き込みを溜めて、batchUpdate 1回で送る。
+    複数スレッド（/api/add の同時リクエストや一括処理のワーカー）から共有して使う。
+    """
+
+    def __init__(self, worksheet, batch_rows=SHEET_WRITE_BATCH_ROWS, flush_interval=SHEET_WRITE_FLUSH_SECONDS):
+        self.worksheet = worksheet
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._started = {}   # row -> _Pending（開始マーク・失敗マーク）
+        self._writes = []    # _Pending（値 + 完了マーク）
+        self._timer = None
+        self.api_calls = 0
+        self.rows_written = 0
+
+    def mark_started(self, row):
+        """
+        開始マーク（赤）を予約する。送信は次のまとめ書きのとき。
+        """
+        pending = _Pending(row, [format_row_request(self.worksheet.id, row, COLOR_STARTED)])
+        with self._lock:
+            self._started[row] = pending
+            self._schedule_locked()
+
+    def mark_failed(self, row):
+        """
+        失敗マーク（黄）を予約する。開始マークがまだ送られていなければ置き換える。
+        値は書かないので、次の一括処理でまた対象になる。
+        """
+        pending = _Pending(row, [format_row_request(self.worksheet.id, row, COLOR_FAILED)])
+        with self._lock:
+            started = self._started.pop(row, None)
+            if started is not None:
+                started.done.set()
+            self._started[row] = pending
+            self._schedule_locked()
+
+    def write_row(self, row, values, wait=True):
+        """
+        C:H の値と完了マーク（白）を予約する。
+        wait=True なら実際に送信されるまで待ち、失敗したら例外を投げる。
+        """
+        sheet_id = self.worksheet.id
+        pending = _Pending(row, [
+            update_row_request(sheet_id, row, values),
+            format_row_request(sheet_id, row, COLOR_DONE),
+        ])
+        with self._lock:
+            # 開始マークがまだ送られていなければ、白に戻すだけでよいので捨てる
+            started = self._started.pop(row, None)
+            if started is not None:
+                started.done.set()
+            self._writes.append(pending)
+            full = len(self._writes) >= self.batch_rows
+            if not full:
+                self._schedule_locked()
+
+        if full:
+            self.flush()
+
+        if wait:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+        return pending
+
+    def _schedule_locked(self):
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_interval, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """
+        溜まっている書き込みをすべて batchUpdate 1回で送る。
+        """
+        with self._flush_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                batch = list(self._started.values()) + self._writes
+                self._started = {}
+                self._writes = []
+
+            if not batch:
+                return
+
+            body = {"requests": [r for p in batch for r in p.requests]}
+            error = None
+            try:
+                self.worksheet.spreadsheet.batch_update(body)
+                self.api_calls += 1
+                self.rows_written += sum(1 for p in batch if len(p.requests) > 1)
+            except Exception as e:
+                print("⚠ スプレッドシートへの書き込みに失敗:", e)
+                error = e
+
+            for p in batch:
+                p.error = error
+                p.done.set()
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._writes)
+        return {
+            "pending_rows": pending,
+            "api_calls": self.api_calls,
+            "rows_written": self.rows_written,
+        }
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(worksheet):
+    """
+    ワークシートごとに1つの SheetWriter を共有する。
+    同じシートへの同時リクエストは、同じバッファに溜まって一緒に送られる。
+    """
+    key = (worksheet.spreadsheet.id, worksheet.id)
+    with _writers_lock:
+        writer = _writers.get(key)
+        if writer is None:
+            writer = _writers[key] = SheetWriter(worksheet)
+        else:
+            writer.worksheet = worksheet
+        return writer
+
+
+def writer_stats():
+    with _writers_lock:
+        writers = dict(_writers)
+    return {f"{sid}/{wid}": w.stats() for (sid, wid), w in writers.items()}
+
+
+class _ClientEntry:
+    def __init__(self, creds, client):
+        self.creds = creds
+        self.client = client
+        self.worksheets = {}  # (spreadsheet_id, sheet_name) -> Worksheet
+        self.lock = threading.Lock()
+        self.last_used = time.time()
+
+
+class SheetClientCache:
+    """
+    サービスアカウントの JSON（の sha256）ごとに gspread のクライアントを保持し、
+    その中で開いたワークシートも (spreadsheet_id, sheet_name) ごとに保持する。
+
+    - アクセストークンは期限が近ければ使う前に更新する（同時に複数スレッドが更新しないようロックする）
+    - 件数が max_entries を超えるか、ttl 秒使われなかったクライアントは捨てる
+    """
+
+    def __init__(self, max_entries=SHEETS_CLIENT_CACHE_SIZE, ttl=SHEETS_CLIENT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def credentials_key(credentials_json):
+        if isinstance(credentials_json, str):
+            credentials_json = credentials_json.encode("utf-8")
+        return hashlib.sha256(credentials_json).hexdigest()
+
+    def _authorize(self, credentials_json):
+        import gspread
+        from google.oauth2 import service_account
+
+        info = json.loads(credentials_json)
+        creds = service_account.Credentials.from_service_account_info(info, scopes=SHEETS_SCOPES)
+        return _ClientEntry(creds, gspread.authorize(creds))
+
+    def _entry(self, credentials_json):
+        key = self.credentials_key(credentials_json)
+        now = time.time()
+        with self._lock:
+            for k in [k for k, e in self._entries.items() if now - e.last_used > self.ttl]:
+                del self._entries[k]
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is None:
+            entry = self._authorize(credentials_json)
+            with self._lock:
+                # 同時に作られていたら先に入った方を使う
+                entry = self._entries.setdefault(key, entry)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+        entry.last_used = now
+        return key, entry
+
+    def _refresh_if_needed(self, entry):
+        if entry.creds.valid:
+            return
+        from google.auth.transport.requests import Request
+
+        with entry.lock:
+            if not entry.creds.valid:
+                entry.creds.refresh(Request())
+
+    def worksheet(self, credentials_json, spreadsheet_id, sheet_name):
+        """
+        認証済みのワークシートを返す。初回だけ認証と open_by_key / worksheet の取得を行う。
+        """
+        _, entry = self._entry(credentials_json)
+        self._refresh_if_needed(entry)
+
+        ws_key = (spreadsheet_id, sheet_name)
+        with entry.lock:
+            ws = entry.worksheets.get(ws_key)
+        with self._lock:
+            if ws is not None:
+                self.hits += 1
+                return ws
+            self.misses += 1
+
+        ws = entry.client.open_by_key(spreadsheet_id).worksheet(sheet_name)
+        with entry.lock:
+            return entry.worksheets.setdefault(ws_key, ws)
+
+    def forget(self, credentials_json, spreadsheet_id=None, sheet_name=None):
+        """
+        書き込みに失敗したときなどに、保持しているワークシート（省略時はクライアントごと）を捨てる。
+        シート名の変更や権限の取り消しのあと、次の呼び出しで開き直させるため。
+        """
+        key = self.credentials_key(credentials_json)
+        with self._lock:
+            if spreadsheet_id is None:
+                self._entries.pop(key, None)
+                return
+            entry = self._entries.get(key)
+        if entry is not None:
+            with entry.lock:
+                entry.worksheets.pop((spreadsheet_id, sheet_name), None)
+
+    def stats(self):
+        with self._lock:
+            clients = len(self._entries)
+            worksheets = sum(len(e.worksheets) for e in self._entries.values())
+            hits, misses = self.hits, self.misses
+        return {
+            "clients": clients,
+            "worksheets": worksheets,
+            "hits": hits,
+            "misses": misses,
+        }
+
+
+sheet_clients = SheetClientCache()
+
+
+# ========== シートの一括処理 ==========
+
+class SyncAlreadyRunning(Exception):
+    """
+    同じシートの一括処理がすでに動いている。
+    """
+
+
+class SyncCheckpoint:
+    """
+    一括処理の行ごとの状態を SQLite に残す。
+
+    - researched: リサーチは終わったが、シートへの書き込みがまだ確認できていない
+    - written:    シートへの書き込みまで終わった
+    - failed:     リサーチに失敗した（attempts 回）
+
+    書き込みが済んだ行は C:H が埋まるので、再開時はシートの内容だけで飛ばせる。
+    ここに残すのは、書き込む前に止まった行の結果（再開時にリサーチし直さず書く）と、
+    失敗を繰り返す行の回数（SHEET_SYNC_MAX_ATTEMPTS で打ち切る）。
+    """
+
+    def __init__(self, path=SHEET_SYNC_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sheet_sync_rows ("
+                "sheet_key TEXT NOT NULL, row INTEGER NOT NULL, "
+                "row_key TEXT NOT NULL, status TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, values_json TEXT, error TEXT, "
+                "updated_at REAL NOT NULL, PRIMARY KEY (sheet_key, row))"
+            )
+            # 以前の列名（shop_key）で作られたファイルはそのまま使えるように直す
+            columns = [c[1] for c in self._conn.execute("PRAGMA table_info(sheet_sync_rows)")]
+            if "shop_key" in columns:
+                self._conn.execute("ALTER TABLE sheet_sync_rows RENAME COLUMN shop_key TO row_key")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def load(self, sheet_key):
+        """
+        row -> {"row_key", "status", "attempts", "values"}
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT row, row_key, status, attempts, values_json FROM sheet_sync_rows WHERE sheet_key = ?",
+                (sheet_key,),
+            ).fetchall()
+        return {
+            row: {
+                "row_key": row_key,
+                "status": status,
+                "attempts": attempts,
+                "values": json.loads(values_json) if values_json else None,
+            }
+            for row, row_key, status, attempts, values_json in rows
+        }
+
+    def _upsert(self, sheet_key, row, row_key, status, values=None, error=None, failed=False):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO sheet_sync_rows "
+                "(sheet_key, row, row_key, status, attempts, values_json, error, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (sheet_key, row) DO UPDATE SET "
+                "attempts = CASE WHEN sheet_sync_rows.row_key = excluded.row_key "
+                "THEN sheet_sync_rows.attempts + excluded.attempts ELSE excluded.attempts END, "
+                "row_key = excluded.row_key, status = excluded.status, "
+                "values_json = excluded.values_json, error = excluded.error, updated_at = excluded.updated_at",
+                (
+                    sheet_key, row, row_key, status, 1 if failed else 0,
+                    json.dumps(values, ensure_ascii=False) if values is not None else None,
+                    error, time.time(),
+                ),
+            )
+            self._conn.commit()
+
+    def record_result(self, sheet_key, row, row_key, values):
+        self._upsert(sheet_key, row, row_key, "researched", values=values)
+
+    def record_written(self, sheet_key, row, row_key):
+        self._upsert(sheet_key, row, row_key, "written")
+
+    def record_failure(self, sheet_key, row, row_key, error):
+        self._upsert(sheet_key, row, row_key, "failed", error=str(error), failed=True)
+
+
+def row_key(shopname, shopaddress):
+    """
+    行の A/B 列（店名・住所）そのもののハッシュ。チェックポイントの結果がいまの行の内容のものかを確かめる。
+    表記ゆれをならす normalize.shop_key と違い、1文字でも書き換えられたら別の行として調べ直す。
+    """
+    return hashlib.sha256(f"{shopname}\n{shopaddress}".encode("utf-8")).hexdigest()
+
+
+def read_pending_rows(worksheet, first_row=2):
+    """
+    A:H を batch_get 1回で読み、A（店名）と B（住所）があって C:H が空の行を返す。
+    [(row, shopname, shopaddress), ...]
+    """
+    value_range = worksheet.batch_get([f"A{first_row}:H"])[0]
+    pending = []
+    for i, cells in enumerate(value_range):
+        cells = [str(c).strip() for c in cells] + [""] * (ROW_END_COLUMN - len(cells))
+        shopname, shopaddress = cells[0], cells[1]
+        if shopname and shopaddress and not any(cells[VALUE_START_COLUMN:ROW_END_COLUMN]):
+            pending.append((first_row + i, shopname, shopaddress))
+    return pending
+
+
+_running_syncs = set()
+_running_syncs_lock = threading.Lock()
+
+
+def sheet_key_of(worksheet):
+    return f"{worksheet.spreadsheet.id}/{worksheet.id}"
+
+
+def is_sync_running(worksheet):
+    with _running_syncs_lock:
+        return sheet_key_of(worksheet) in _running_syncs
+
+
+def sync_sheet(
+    worksheet,
+    research,
+    checkpoint,
+    first_row=2,
+    limit=None,
+    max_workers=SHEET_SYNC_MAX_WORKERS,
+    max_attempts=SHEET_SYNC_MAX_ATTEMPTS,
+    progress=None,
+):
+    """
+    C:H が空の行をまとめてリサーチし、結果を SheetWriter でまとめ書きする。
+
+    research(shopname, shopaddress) は C:H に書く6つの値を返す関数（失敗時は例外）。
+    progress(stage=None, **counts) には件数の途中経過を渡す（Job.report を想定）。
+    """
+    sheet_key = sheet_key_of(worksheet)
+    with _running_syncs_lock:
+        if sheet_key in _running_syncs:
+            raise SyncAlreadyRunning(f"{worksheet.title} は一括処理中です")
+        _running_syncs.add(sheet_key)
+
+    try:
+        pending = read_pending_rows(worksheet, first_row)
+        state = checkpoint.load(sheet_key)
+        writer = get_writer(worksheet)
+
+        restore = []   # 前回リサーチ済みで、書き込みだけ残っている行
+        todo = []      # これからリサーチする行
+        skipped = 0
+        for row, shopname, shopaddress in pending:
+            key = row_key(shopname, shopaddress)
+            saved = state.get(row)
+            if saved is not None and saved["row_key"] == key:
+                if saved["status"] == "researched" and saved["values"]:
+                    restore.append((row, key, saved["values"]))
+                    continue
+                if saved["status"] == "failed" and saved["attempts"] >= max_attempts:
+                    skipped += 1
+                    continue
+            todo.append((row, shopname, shopaddress, key))
+
+        if limit is not None:
+            todo = todo[:limit]
+
+        counts = {
+            "pending": len(pending),
+            "total": len(todo) + len(restore),
+            "restored": 0,
+            "done": 0,
+            "failed": 0,
+            "write_failed": 0,
+            "skipped": skipped,
+        }
+        counts_lock = threading.Lock()
+
+        def report(stage=None, **delta):
+            with counts_lock:
+                for k, v in delta.items():
+                    counts[k] += v
+                snapshot = dict(counts)
+            if progress is not None:
+                progress(stage=stage, **snapshot)
+
+        report(stage="sheet_sync")
+
+        if restore:
+            written = [(row, key, writer.write_row(row, values, wait=False)) for row, key, values in restore]
+            writer.flush()
+            for row, key, p in written:
+                p.done.wait()
+                if p.error is None:
+                    checkpoint.record_written(sheet_key, row, key)
+                    report(restored=1)
+                else:
+                    report(write_failed=1)
+
+        def process(item):
+            row, shopname, shopaddress, key = item
+            writer.mark_started(row)
+            try:
+                values = research(shopname, shopaddress)
+            except Exception as e:
+                print(f"⚠ {row}行目（{shopname}）のリサーチに失敗: {e}")
+                # 開始マーク（赤）を残さない。ほかの行の書き込みと一緒に送る
+                writer.mark_failed(row)
+                checkpoint.record_failure(sheet_key, row, key, e)
+                report(failed=1)
+                return
+
+            # 書き込み前に止まっても、再開時にリサーチし直さずに済むよう先に残す
+            checkpoint.record_result(sheet_key, row, key, values)
+            try:
+                writer.write_row(row, values)
+            except Exception:
+                report(write_failed=1)
+                return
+            checkpoint.record_written(sheet_key, row, key)
+            report(done=1)
+
+        workers = max(1, min(max_workers, len(todo) or 1))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sheet-sync") as ex:
+            list(ex.map(process, todo))
+        writer.flush()
+
+        return dict(counts, sheet=worksheet.title)
+    finally:
+        with _running_syncs_lock:
+            _running_syncs.discard(sheet_key)
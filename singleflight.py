@@ -0,0 +1,59 @@
+"""
+同じキーの処理が同時に走っているとき、後から来た呼び出しは新しく実行せず、
+先に走っている処理（リーダー）の結果を待って受け取る（Go の singleflight と同じ考え方）。
+
+結果を保存するキャッシュではない。リーダーが終わればキーは消え、次の呼び出しはまた実行する。
+"""
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> Future
+        self.leaders = 0
+        self.shared = 0
+
+    def do(self, key, fn, *args):
+        """
+        fn(*args) を実行して (結果, shared) を返す。
+        同じ key がすでに実行中なら、その結果を待って shared=True で返す。
+        リーダーの例外はそのまま待っていた呼び出しにも投げる。
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is None:
+                future = self._calls[key] = Future()
+                self.leaders += 1
+                leader = True
+            else:
+                self.shared += 1
+                leader = False
+
+        if leader:
+            try:
+                value = fn(*args)
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+            else:
+                future.set_result(value)
+                return value, False
+            finally:
+                with self._lock:
+                    self._calls.pop(key, None)
+
+        return future.result(), True
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight(),
+            "leaders": self.leaders,
+            "shared": self.shared,
+        }
@@ -0,0 +1,156 @@
+"""
+起動時間（コールドスタート）まわり。
+
+- warmup(): 最初のリクエストより前に、ホットパスで使う重いモジュールと HTTP セッションを用意する
+  WARMUP=sync なら import 時にその場で、WARMUP=background ならバックグラウンドのスレッドで行う
+- python startup.py: `python -X importtime -c "import main"` の結果を集計して、
+  import に時間のかかっているモジュールを表示する。--budget-ms を超えたら終了コード 1
+  （CI で起動時間の悪化に気づけるように）
+
+例:
+  python startup.py --top 15
+  python startup.py --budget-ms 1500
+"""
+import argparse
+import importlib
+import os
+import subprocess
+import sys
+import threading
+import time
+
+# off / sync / background
+WARMUP = os.environ.get("WARMUP", "off")
+# gspread / google-auth も先読みするか（/api/add・/api/sheet/sync を使う構成向け）
+WARMUP_SHEETS = os.environ.get("WARMUP_SHEETS", "1") == "1"
+
+# ResearchAI のホットパスで、初回のリクエスト中に import されるもの
+# （charset_normalizer は requests の import で読み込まれるので含めない）
+WARMUP_MODULES = [
+    "html_text",
+    "lxml.html",
+]
+SHEETS_MODULES = [
+    "gspread",
+    "google.oauth2.service_account",
+    "google.auth.transport.requests",
+]
+
+
+def warmup(hooks=(), sheets=WARMUP_SHEETS):
+    """
+    モジュールを import し、hooks（引数なしの関数）を順に呼ぶ。
+    {名前: 秒数} を返す。失敗しても起動は止めない。
+    """
+    timings = {}
+    modules = WARMUP_MODULES + (SHEETS_MODULES if sheets else [])
+    for name in modules:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            print(f"⚠ warmup: {name} を読み込めません: {e}")
+            continue
+        timings[name] = time.perf_counter() - start
+
+    for hook in hooks:
+        name = getattr(hook, "__name__", repr(hook))
+        start = time.perf_counter()
+        try:
+            hook()
+        except Exception as e:
+            print(f"⚠ warmup: {name} に失敗: {e}")
+            continue
+        timings[name] = time.perf_counter() - start
+    return timings
+
+
+def start_warmup(mode=None, hooks=(), on_done=None):
+    """
+    mode（省略時は WARMUP）に従って warmup() を実行する。
+    on_done(total_seconds, timings) は終わったときに呼ばれる。
+    """
+    mode = mode or WARMUP
+    if mode not in ("sync", "background"):
+        return None
+
+    def run():
+        start = time.perf_counter()
+        timings = warmup(hooks)
+        total = time.perf_counter() - start
+        print(f"[warmup] {total * 1000:.0f} ms: " + ", ".join(f"{k}={v * 1000:.0f}ms" for k, v in timings.items()))
+        if on_done is not None:
+            on_done(total, timings)
+
+    if mode == "sync":
+        run()
+        return None
+
+    thread = threading.Thread(target=run, name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+# ========== import 時間の集計 ==========
+
+def parse_importtime(stderr):
+    """
+    -X importtime の出力を [(module, self_us, cumulative_us, depth), ...] にする。
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        self_us, cumulative_us, name = parts
+        # 先頭の空白1つのあと、入れ子1段ごとに空白2つ
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def import_report(target="main", python=sys.executable, cwd=None):
+    """
+    別プロセスで target を import し、(合計マイクロ秒, rows) を返す。
+    """
+    env = dict(os.environ, WARMUP="off")
+    proc = subprocess.run(
+        [python, "-X", "importtime", "-c", f"import {target}"],
+        capture_output=True,
+        text=True,
+        cwd=cwd or os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"{target} の import に失敗しました:\n{proc.stderr[-2000:]}")
+
+    rows = parse_importtime(proc.stderr)
+    total = next((cum for name, _, cum, depth in rows if name == target and depth == 0), None)
+    if total is None:
+        total = sum(cum for _, _, cum, depth in rows if depth == 0)
+    return total, rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="import 時間の内訳を表示する")
+    parser.add_argument("--target", default="main")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--budget-ms", type=float, help="これを超えたら終了コード 1")
+    args = parser.parse_args(argv)
+
+    total, rows = import_report(args.target)
+    print(f"import {args.target}: {total / 1000:.1f} ms")
+    print(f"{'cumulative':>12s} {'self':>10s}  module")
+    for name, self_us, cumulative_us, depth in sorted(rows, key=lambda r: -r[2])[:args.top]:
+        print(f"{cumulative_us / 1000:10.1f}ms {self_us / 1000:8.1f}ms  {'  ' * depth}{name}")
+
+    if args.budget_ms is not None and total / 1000 > args.budget_ms:
+        print(f"✖ import 時間が予算 {args.budget_ms:.0f} ms を超えています")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())